@@ -31,6 +31,7 @@ from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import (FigureCanvasTkAgg, NavigationToolbar2Tk)
 import functools
 fp = functools.partial
+TR_ELL_TEMPLATE = "template_TR.ELL.xml"
 
 
 class App(Tk):
@@ -74,6 +75,8 @@ class App(Tk):
         self.filemenu.add_command(label="Export to Xml", command=self.export_to_xml)
         self.filemenu.add_command(label="Export to Html", command=self.export_to_html)
         self.filemenu.add_command(label="Export to Sql", command=self.generate_sql)
+        self.filemenu.add_command(label="Export result to Csv", command=self.export_result_to_csv)
+        self.filemenu.add_command(label="Export result to Json Lines", command=self.export_result_to_jsonl)
         self.filemenu.add_separator()
         self.filemenu.add_command(label="Exit", command=self.on_closing)
         self.menubar.add_cascade(label="File", menu=self.filemenu)
@@ -168,12 +171,19 @@ class App(Tk):
                 sep = config['delimiter']
                 hdr = 'infer' if config['header'] == 'True' else None
                 enc = config['encoding']
+                csv_engine = config.get('engine', 'c')
                 jlx_config = cfg.load_config(section='JL10')
                 jlx_spec = jlx_config['specification']
                 fwf_config = cfg.load_config(section='FWF')
                 nrows = 0 if self.on_the_fly_mode else None
+                usecols = None
+                if not self.on_the_fly_mode and self.csv_file.get().lower().endswith('tr.ell.csv') and os.path.exists(TR_ELL_TEMPLATE):
+                    # The TR.ELL template is imported right after loading: only its columns (and FIELD_R of the threshold check) are loaded
+                    usecols = util.get_template_columns(TR_ELL_TEMPLATE)
+                    if usecols is not None:
+                        usecols.append('FIELD_R')
                 self.engine = RuleEngine()
-                self.engine.df, tr_ell, above_threshold = util.get_dataframe(self.csv_file.get().lower(), delimiter=sep, header=hdr, encoding=enc, type=object, jlx_spec=jlx_spec, fwf_spec=fwf_config, nrows=nrows)
+                self.engine.df, tr_ell, above_threshold = util.get_dataframe(self.csv_file.get().lower(), delimiter=sep, header=hdr, encoding=enc, type=object, jlx_spec=jlx_spec, fwf_spec=fwf_config, nrows=nrows, usecols=usecols, engine=csv_engine, na_filter=False)
                 if self.engine is not None and self.engine.df is not None:
                     if above_threshold:
                         mb.showwarning(title="Warning!", message="FIELD_R column violates the threshold rule!", parent=self)
@@ -272,6 +282,22 @@ class App(Tk):
         if filename:
             util.df2html(filename.show(), self.engine.df)
 
+    def export_result_to_csv(self):
+        filename = fd.SaveAs(initialfile='result.csv', defaultextension=".csv", filetypes=[("CSV Files","*.csv")])
+        if filename:
+            self.export_result(filename.show())
+
+    def export_result_to_jsonl(self):
+        filename = fd.SaveAs(initialfile='result.jsonl', defaultextension=".jsonl", filetypes=[("JSON Lines Files","*.jsonl")])
+        if filename:
+            self.export_result(filename.show())
+
+    def export_result(self, filename):
+        if filename and self.engine:
+            config = cfg.load_config(section='general')
+            actual_row_number = config.get('display_actual_row_number', 'True') == 'True'
+            util.write_result(filename, self.engine.anomalies, actual_row_number)
+
     def generate_sql(self):
         filename = fd.SaveAs(initialfile='output.sql', defaultextension=".sql", filetypes=[("SQL Files","*.sql")])
         if filename:
@@ -366,6 +392,8 @@ class App(Tk):
         self.filemenu.entryconfig("Export to Xml", state="disabled")
         self.filemenu.entryconfig("Export to Html", state="disabled")
         self.filemenu.entryconfig("Export to Sql", state="disabled")
+        self.filemenu.entryconfig("Export result to Csv", state="disabled")
+        self.filemenu.entryconfig("Export result to Json Lines", state="disabled")
 
     def enable_data_menu(self):
         self.utilitiesmenu.entryconfig("Data structure", state="normal")
@@ -459,8 +487,12 @@ class App(Tk):
         self.enable_text_area()
         self.clear_text_area()
         config = cfg.load_config(section='general')
-        actual_row_number = config['display_actual_row_number'] == 'True'
-        total, txt_content = util.get_result(self.engine.anomalies, actual_row_number)
+        actual_row_number = config.get('display_actual_row_number', 'True') == 'True'
+        # Summary mode: only the first rows of every column are displayed, the full result is exported to a file
+        max_rows = int(config['display_max_rows']) if config.get('display_max_rows') else None
+        total, txt_content = util.get_result(self.engine.anomalies, actual_row_number, max_rows)
+        self.filemenu.entryconfig("Export result to Csv", state="normal")
+        self.filemenu.entryconfig("Export result to Json Lines", state="normal")
         self.text_area_style('black', 'white')
         exec_panel_func()
         if start_row < 0 or end_row < 0:
@@ -505,7 +537,15 @@ class App(Tk):
                 #self.init_result_display_on_the_fly_mode(self.show_exec_panel)
                 #invalid_counter = 0
                 start = time.time()
-                self.engine.fire_all_rules_on_the_fly(self.csv_file.get(), cfg.load_config()['delimiter'])
+                config = cfg.load_config()
+                # The fixed width files are read with their own (memory mapped) reader, the csv files through a memory map,
+                # split into byte ranges checked by the local worker processes (one worker: single process)
+                reader = util.get_stream_reader(self.csv_file.get(), cfg.load_config(section='JL10')['specification'], cfg.load_config(section='FWF'))
+                if reader is None:
+                    workers = int(cfg.load_config(section='general').get('local_workers', 1))
+                    self.engine.fire_all_rules_on_the_fly_parallel(self.csv_file.get(), config['delimiter'], workers, encoding=config['encoding'], memory_map=True)
+                else:
+                    self.engine.fire_all_rules_on_the_fly(self.csv_file.get(), config['delimiter'], encoding=config['encoding'], memory_map=True, reader=reader)
                 #for r in self.engine.fire_all_rules_on_the_fly_v2(self.csv_file.get(), cfg.load_config()['delimiter']):
                 #    self.result_display_on_the_fly_mode(r)
                 #    invalid_counter += 1
@@ -517,7 +557,10 @@ class App(Tk):
                     self.enable_client_mode()
                 else:
                     start = time.time()
-                    self.engine.fire_all_rules()
+                    # Local worker processes (one worker: single process), sharding by columns or rows
+                    config = cfg.load_config(section='general')
+                    workers = int(config.get('local_workers', 1))
+                    self.engine.fire_all_rules_parallel(workers, shard_by=config.get('local_shard_by', 'columns'))
                     end = time.time()
                     self.result_display(1, self.engine.df.shape[0], end - start, self.show_exec_panel)
             
@@ -529,7 +572,14 @@ class App(Tk):
         self.text_area['bg'] = bg_color
         self.text_area['fg'] = fg_color
 
-    def gui_callback(self, start_row, end_row, exec_time):
+    def gui_callback(self, start_row, end_row, exec_time, anomalies=None):
+        # Called by the client sessions of the server (worker threads): the result of the last session is
+        # displayed (and exported) by the Tk main loop, one at a time
+        self.after(0, self.server_result_display, start_row, end_row, exec_time, anomalies)
+
+    def server_result_display(self, start_row, end_row, exec_time, anomalies):
+        if anomalies is not None:
+            self.engine.anomalies = anomalies
         self.result_display(start_row, end_row, exec_time, self.show_exec_panel_in_server_mode)
 
     def enable_server_mode(self):
@@ -594,7 +644,7 @@ class App(Tk):
         sys.exit()
 
     def import_tr_ell_template(self):
-        filename = "template_TR.ELL.xml"
+        filename = TR_ELL_TEMPLATE
         if os.path.exists(filename):
             rules_attrib, xml_rules, cross_validation = util.import_from_xml_template(filename)
             op = str(None)
@@ -928,7 +978,8 @@ class ConfigWindow(tk.Toplevel):
         self.savebtn.bind('<Button-1>', self.save_and_exit)
 
     def save_and_exit(self, event):
-        config = {}
+        # The other settings of the section (e.g. engine) are kept
+        config = cfg.load_config()
         config['delimiter'] = self.delimiter.get()
         config['header'] = self.header.get()
         config['encoding'] = self.encoding.get()
@@ -0,0 +1,256 @@
+#
+# project: CSV Validator
+#
+# Anomaly Store Module
+#
+# georgios mountzouris 2025 (gmountzouris@efka.gov.gr)
+#
+
+import json
+import numpy as np
+
+
+class AnomalyColumn():
+    # Invalid values of a column as chunks of (int64 row array, values, rule). The values of a chunk are either
+    # stored (list) or referenced into the checked column: (series, offset), value of row r = series.iloc[r - offset].
+    # The rule (name of the failed rule) is given per chunk, or per row as a list.
+    # Iterating yields the (row, value) tuples lazily: the stored ones, then the sample of the ones past the cap.
+    BLOCK_SIZE = 65536
+
+    def __init__(self):
+        self.chunks = []
+        # count: all the invalid values found, stored: the ones kept (count - stored are only counted)
+        self.count = 0
+        self.stored = 0
+        # Reservoir sample of the invalid values past the cap
+        self.seen = 0
+        self.sample_rows = []
+        self.sample_values = []
+        self.sample_rules = []
+        # The evaluation stopped at the cap (early exit), count is a lower bound
+        self.partial = False
+
+    def add(self, rows, values, rule=None):
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) > 0:
+            self.chunks.append((rows, list(values), rule))
+            self.count += len(rows)
+            self.stored += len(rows)
+
+    def add_reference(self, rows, source, offset, rule=None):
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) > 0:
+            self.chunks.append((rows, (source, offset), rule))
+            self.count += len(rows)
+            self.stored += len(rows)
+
+    def overflow(self, rows, get_values, rule, sample_size, rng):
+        # Count the invalid rows past the cap and keep a reservoir sample (algorithm R) of them,
+        # get_values(positions) returns the values of rows[positions]
+        n = len(rows)
+        self.count += n
+        if sample_size > 0 and n > 0:
+            t = self.seen + np.arange(n)
+            slots = np.where(t < sample_size, t, rng.integers(0, t + 1))
+            picked = np.flatnonzero(slots < sample_size)
+            for p, value in zip(picked.tolist(), get_values(picked)):
+                slot = int(slots[p])
+                row_rule = rule[p] if isinstance(rule, list) else rule
+                if slot < len(self.sample_rows):
+                    self.sample_rows[slot] = int(rows[p])
+                    self.sample_values[slot] = value
+                    self.sample_rules[slot] = row_rule
+                else:
+                    self.sample_rows.append(int(rows[p]))
+                    self.sample_values.append(value)
+                    self.sample_rules.append(row_rule)
+        self.seen += n
+
+    @property
+    def truncated(self):
+        return self.count > self.stored
+
+    def iter_blocks(self, block_size=BLOCK_SIZE, values=True):
+        # (int64 row array, value list, rule) blocks, the rule is a name or a list of names (one per row).
+        # The referenced values are fetched block by block, not at all with values=False (None instead).
+        chunks = self.chunks
+        if self.sample_rows:
+            order = np.argsort(self.sample_rows, kind='stable')
+            chunks = chunks + [(np.asarray(self.sample_rows, dtype=np.int64)[order], [self.sample_values[i] for i in order], [self.sample_rules[i] for i in order])]
+        for rows, chunk_values, rule in chunks:
+            for start in range(0, len(rows), block_size):
+                block = rows[start:start + block_size]
+                block_values = None
+                if not values:
+                    pass
+                elif isinstance(chunk_values, tuple):
+                    source, offset = chunk_values
+                    block_values = source.iloc[block - offset].tolist()
+                else:
+                    block_values = chunk_values[start:start + block_size]
+                yield block, block_values, rule[start:start + block_size] if isinstance(rule, list) else rule
+
+    def iter_chunks(self, block_size=BLOCK_SIZE, rules=False):
+        # (row list, value list) blocks, plus the rule list of the block with rules=True
+        for block, block_values, rule in self.iter_blocks(block_size):
+            if not rules:
+                yield block.tolist(), block_values
+            elif isinstance(rule, list):
+                yield block.tolist(), block_values, rule
+            else:
+                yield block.tolist(), block_values, [rule] * len(block)
+
+    def __iter__(self):
+        for rows, values in self.iter_chunks():
+            yield from zip(rows, values)
+
+    def __len__(self):
+        return self.count
+
+    def __bool__(self):
+        return self.count > 0
+
+
+class AnomalyStore():
+    # Dict like container of the invalid values: column -> AnomalyColumn.
+    # Optional caps on the stored invalid values per column and in total, past them the invalid values
+    # are only counted (plus a reservoir sample of sample_size rows per column).
+    def __init__(self, max_per_column=None, max_total=None, sample_size=0, seed=None):
+        self.columns = {}
+        self.max_per_column = max_per_column
+        self.max_total = max_total
+        self.sample_size = sample_size
+        self.stored = 0
+        self.rng = np.random.default_rng(seed)
+
+    @property
+    def capped(self):
+        return self.max_per_column is not None or self.max_total is not None
+
+    def room(self, col):
+        # Number of invalid values the column can still store (None: no cap)
+        room = None
+        if self.max_per_column is not None:
+            room = max(self.max_per_column - col.stored, 0)
+        if self.max_total is not None:
+            total_room = max(self.max_total - self.stored, 0)
+            room = total_room if room is None else min(room, total_room)
+        return room
+
+    def is_full(self, column):
+        col = self.columns.get(column)
+        return self.room(col if col is not None else AnomalyColumn()) == 0
+
+    def column(self, column):
+        col = self.columns.get(column)
+        if col is None:
+            col = self.columns[column] = AnomalyColumn()
+        return col
+
+    def add(self, column, rows, values, rule=None):
+        # rule: name of the failed rule, for all the rows or per row (list)
+        if len(rows) > 0:
+            col = self.column(column)
+            rows = np.asarray(rows, dtype=np.int64)
+            room = self.room(col)
+            if room is not None and len(rows) > room:
+                col.overflow(rows[room:], lambda positions: [values[room + p] for p in positions], rule[room:] if isinstance(rule, list) else rule, self.sample_size, self.rng)
+                rows, values = rows[:room], values[:room]
+                if isinstance(rule, list):
+                    rule = rule[:room]
+            col.add(rows, values, rule)
+            self.stored += len(rows)
+
+    def add_reference(self, column, rows, source, offset, rule=None):
+        # rows: invalid rows of the checked column slice source, offset: row number of its first element
+        if len(rows) > 0:
+            col = self.column(column)
+            rows = np.asarray(rows, dtype=np.int64)
+            room = self.room(col)
+            if room is not None and len(rows) > room:
+                overflow_rows = rows[room:]
+                col.overflow(overflow_rows, lambda positions: source.iloc[overflow_rows[positions] - offset].tolist(), rule[room:] if isinstance(rule, list) else rule, self.sample_size, self.rng)
+                rows = rows[:room]
+                if isinstance(rule, list):
+                    rule = rule[:room]
+            col.add_reference(rows, source, offset, rule)
+            self.stored += len(rows)
+
+    def merge(self, column, rows, values, count, partial=False, rule=None):
+        # Add the result of a column checked elsewhere: count invalid values in total, of which rows / values are kept
+        self.add(column, rows, values, rule)
+        self.set_count(column, count, len(rows), partial)
+
+    def set_count(self, column, count, received, partial=False):
+        # Complete the count of a column checked elsewhere: count invalid values in total, of which received were added
+        col = self.column(column)
+        col.count += count - received
+        col.partial = col.partial or partial
+
+    def update(self, anomalies):
+        # Merge a dictionary {column: [(row, value), ...]} (e.g. the json result of a server)
+        for column, invalid_list in anomalies.items():
+            if invalid_list:
+                rows, values = zip(*invalid_list)
+                self.add(column, rows, values)
+
+    def clear(self):
+        self.columns.clear()
+        self.stored = 0
+
+    def empty_copy(self):
+        # New empty store with the same caps
+        return AnomalyStore(self.max_per_column, self.max_total, self.sample_size)
+
+    def counts(self):
+        return {k: len(v) for k, v in self.columns.items()}
+
+    def truncated(self):
+        return [k for k, v in self.columns.items() if v.truncated or v.partial]
+
+    def total(self):
+        return sum(len(v) for v in self.columns.values())
+
+    def to_dict(self):
+        return {k: list(v) for k, v in self.columns.items()}
+
+    def iter_json(self):
+        # Pieces of the json encoding of to_dict(), without materializing the (row, value) tuples
+        yield '{'
+        for i, (column, col) in enumerate(self.columns.items()):
+            yield (', ' if i > 0 else '') + json.dumps(column) + ': ['
+            first = True
+            for rows, values in col.iter_chunks():
+                piece = json.dumps(list(map(list, zip(rows, values))))[1:-1]
+                if piece:
+                    yield ('' if first else ', ') + piece
+                    first = False
+            yield ']'
+        yield '}'
+
+    def to_json(self):
+        return ''.join(self.iter_json())
+
+    def keys(self):
+        return self.columns.keys()
+
+    def values(self):
+        return self.columns.values()
+
+    def items(self):
+        return self.columns.items()
+
+    def get(self, column, default=None):
+        return self.columns.get(column, default)
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def __contains__(self, column):
+        return column in self.columns
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return len(self.columns)
@@ -7,10 +7,12 @@
 #
 
 import json
+import time
 import socket
-import hashlib
 import threading
 import v_utilities as util
+import v_protocol as protocol
+from concurrent.futures import ThreadPoolExecutor, as_completed
 #from tqdm import tqdm
 
 
@@ -23,9 +25,15 @@ FORMAT = "utf-8"
 anomalies_dict = {}
 status_result = []
 c = threading.Condition()
+# Servers which did not answer the v2 handshake (address -> time until which they are used with v1), they are asked
+# again after V1_SERVER_TTL seconds (e.g. a v2 server which was too busy to answer)
+v1_servers = {}
+V1_SERVER_TTL = 600
 
 def handle_server(addr, engine, df_string, df_hash, xml_rules, cursor, chunk_size):
+    # Returns True when the anomalies of the server were received and merged
     server_df_hash = ""
+    success_flag = True
     try:
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server_socket.settimeout(3)
@@ -37,8 +45,14 @@ def handle_server(addr, engine, df_string, df_hash, xml_rules, cursor, chunk_siz
             server_df_hash = server_socket.recv(SIZE).decode(FORMAT)
         except Exception as e:
             print(f"Error while sending the dataframe hash to server: {repr(e)}")
+            success_flag = False
 
-        if server_df_hash == df_hash:
+        if server_df_hash != df_hash:
+            print(f"The dataframe of the server {addr[0]} is not the same")
+            success_flag = False
+        else:
+            # The server answers the fire message once the rules are checked
+            server_socket.settimeout(protocol.READ_TIMEOUT)
             """ Step #1 """
             # Sending the cursor & chunk size to server. """
             try:
@@ -47,6 +61,7 @@ def handle_server(addr, engine, df_string, df_hash, xml_rules, cursor, chunk_siz
                 msg = server_socket.recv(SIZE).decode(FORMAT)
             except Exception as e:
                 print(f"Error while sending the cursor & chunk size to server: {repr(e)}")
+                success_flag = False
 
             """ Step #2 """
             # Sending ruleset to the server.
@@ -62,6 +77,7 @@ def handle_server(addr, engine, df_string, df_hash, xml_rules, cursor, chunk_siz
                 server_socket.send("@RULES-END@".encode(FORMAT))
             except Exception as e:
                 print(f"Error while sending ruleset to the server: {repr(e)}")
+                success_flag = False
 
             """
             # Sending the dataframe to the server.
@@ -98,14 +114,18 @@ def handle_server(addr, engine, df_string, df_hash, xml_rules, cursor, chunk_siz
                     #print(anomalies_dict)
                 except Exception as e:
                     print(f"Error while loading the json: {repr(e)}")
+                    success_flag = False
                 try:
                     engine.anomaly_detection(column=None, result=anomalies_dict, is_dictionary=True)
                 except Exception as e:
                     print(f"Error while running anomaly detection: {repr(e)}")
+                    success_flag = False
             except Exception as e:
                 print(f"Error while receiving anomalies from server: {repr(e)}")
+                success_flag = False
     except Exception as e:
         print(f"Error while handling server connection: {repr(e)}")
+        success_flag = False
     finally:
         try:
             """ Last Step """
@@ -114,6 +134,97 @@ def handle_server(addr, engine, df_string, df_hash, xml_rules, cursor, chunk_siz
             server_socket.close()
         except:
             pass
+    return success_flag
+
+def receive_anomalies(server_socket, engine):
+    # The anomalies of a v2 server are merged as they arrive: binary blocks with the row numbers only (the values
+    # are referenced in the dataframe of the engine, the same as the server's) or json (servers without binary encoding)
+    json_parts = []
+    received = {}
+    while True:
+        command, payload = protocol.recv_message(server_socket)
+        if command == "ANOMALIES-BIN":
+            column, rows, values, rule = protocol.decode_block(payload)
+            with engine.lock:
+                if values is None:
+                    engine.anomalies.add_reference(column, rows, engine.df[column], 1, rule)
+                else:
+                    engine.anomalies.add(column, rows, values, rule)
+            received[column] = received.get(column, 0) + len(rows)
+        elif command == "ANOMALIES-BIN-END":
+            with engine.lock:
+                for column, count, partial in json.loads(bytes(payload).decode(FORMAT)):
+                    engine.anomalies.set_count(column, count, received.get(column, 0), partial)
+            break
+        elif command == "ANOMALIES":
+            json_parts.append(bytes(payload))
+        elif command == "ANOMALIES-END":
+            engine.anomaly_detection(column=None, result=json.loads(b''.join(json_parts)), is_dictionary=True)
+            break
+        else:
+            raise ValueError(f"Unexpected message {command}")
+
+def handle_server_v2(addr, engine, df_string, xml_rules, cursor, chunk_size):
+    # v2 protocol (length prefixed frames without acknowledgements, see v_protocol).
+    # Returns True when the anomalies of the server were received and merged, None when the server does not support v2.
+    success_flag = True
+    v2 = False
+    server_socket = None
+    try:
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        protocol.configure_socket(server_socket)
+        server_socket.settimeout(3)
+        server_socket.connect(addr)
+        try:
+            server_socket.send(protocol.HANDSHAKE.encode(FORMAT))
+            handshake = server_socket.recv(SIZE).decode(FORMAT).split('#')
+            v2 = handshake[0] == protocol.HANDSHAKE_OK
+        except socket.timeout:
+            pass
+        if not v2:
+            return None
+        # The dataframe hash of the server's scheme
+        df_hash = engine.fingerprint if handshake[1:] == [protocol.FINGERPRINT] else engine.legacy_fingerprint
+        # The server answers the fire message once the rules are checked
+        server_socket.settimeout(protocol.READ_TIMEOUT)
+        protocol.send_message(server_socket, "DATAFRAME-HASH")
+        command, payload = protocol.recv_message(server_socket)
+        if bytes(payload).decode(FORMAT) != df_hash:
+            print(f"The dataframe of the server {addr[0]} is not the same")
+            return False
+        protocol.send_message(server_socket, "RANGE", f"{cursor}#{chunk_size}".encode(FORMAT))
+        protocol.send_message(server_socket, "RULES", xml_rules.encode(FORMAT))
+        if df_string:
+            protocol.send_message(server_socket, "DATAFRAME", df_string.encode(FORMAT))
+        options = {'encoding': 'binary', 'values': False, 'compression': protocol.available_compressions()}
+        protocol.send_message(server_socket, "FIRE", json.dumps(options).encode(FORMAT))
+        receive_anomalies(server_socket, engine)
+    except Exception as e:
+        print(f"Error while handling server connection (protocol v2): {repr(e)}")
+        success_flag = False
+    finally:
+        try:
+            if v2:
+                protocol.send_message(server_socket, "CLOSE")
+            else:
+                server_socket.send("@CLOSE@".encode(FORMAT))
+            server_socket.close()
+        except:
+            pass
+    return success_flag
+
+def timed_handle_server(addr, engine, df_string, xml_rules, cursor, chunk_size):
+    start = time.time()
+    success_flag = None
+    if v1_servers.get(addr, 0) < time.time():
+        success_flag = handle_server_v2(addr, engine, df_string, xml_rules, cursor, chunk_size)
+    if success_flag is None:
+        # Server of a previous version: v1 protocol and the dataframe hash of the previous versions
+        if v1_servers.get(addr, 0) < time.time():
+            print(f"The server {addr[0]} does not support the protocol v2, using v1")
+            v1_servers[addr] = time.time() + V1_SERVER_TTL
+        success_flag = handle_server(addr, engine, df_string, engine.legacy_fingerprint, xml_rules, cursor, chunk_size)
+    return success_flag, time.time() - start
 
 def handle_self_server():
     try:
@@ -153,11 +264,28 @@ def main(engine, server_list, chunk, dummy=False, status_check=False):
         if dummy:
             handle_self_server()
         else:
-            df_hash = hashlib.sha256(engine.df.to_json().encode()).hexdigest()
+            # Computed once here, not in the server threads
+            engine.fingerprint
             xml_rules = util.export_to_xml_template(filename=None, engine=engine, to_string=True)
-            for i, server_ip in enumerate(server_list):
-                ADDR = (server_ip, PORT)
-                #df_string = engine.df[i*chunk:(i*chunk)+chunk].to_csv(sep=';', encoding='utf-8', header=True, index=False)
-                thread = threading.Thread(target=handle_server, args=(ADDR, engine, None, df_hash, xml_rules, i*chunk, chunk))
-                thread.start()
-                thread.join()
+            # All the servers process their chunk at the same time (one thread per server), the anomalies of
+            # every server are merged into the engine as soon as they are received
+            report = []
+            if not server_list:
+                return report
+            with ThreadPoolExecutor(max_workers=len(server_list)) as executor:
+                futures = {}
+                for i, server_ip in enumerate(server_list):
+                    ADDR = (server_ip, PORT)
+                    #df_string = engine.df[i*chunk:(i*chunk)+chunk].to_csv(sep=';', encoding='utf-8', header=True, index=False)
+                    futures[executor.submit(timed_handle_server, ADDR, engine, None, xml_rules, i*chunk, chunk)] = (server_ip, i*chunk)
+                for future in as_completed(futures):
+                    server_ip, cursor = futures[future]
+                    try:
+                        success_flag, exec_time = future.result()
+                    except Exception as e:
+                        print(f"Error while handling server {server_ip}: {repr(e)}")
+                        success_flag, exec_time = False, 0.0
+                    status = "done" if success_flag else "FAILED"
+                    print(f"Server {server_ip}: rows {cursor + 1}-{cursor + chunk} {status} in {exec_time:.2f} sec")
+                    report.append((server_ip, cursor, success_flag, exec_time))
+            return report
@@ -6,7 +6,12 @@
 # georgios mountzouris 2025 (gmountzouris@efka.gov.gr)
 #
 
+import time
+import functools
+import numpy as np
+import pandas as pd
 from dateutil.parser import parse
+from pandas.api.types import infer_dtype
 
 
 def is_digit(n):
@@ -15,10 +20,75 @@ def is_digit(n):
         return True
     except ValueError:
         return False
-    
+
 def is_date(string, fuzzy=False):
-    try: 
+    try:
         parse(string, fuzzy=fuzzy)
         return True
     except ValueError:
         return False
+
+DATE_FORMATS = {"/": ("%d/%m/%Y", "%Y/%m/%d"), "-": ("%d-%m-%Y", "%Y-%m-%d")}
+
+def parse_date(string):
+    # Date format of the *_date rules (DD/MM/YYYY, YYYY/MM/DD, DD-MM-YYYY, YYYY-MM-DD), None if it does not match
+    for sep, formats in DATE_FORMATS.items():
+        if len(string.split(sep)) == 3:
+            for fmt in formats:
+                try:
+                    return time.strptime(string, fmt)
+                except ValueError:
+                    pass
+            return None
+    return None
+
+# Date columns are highly repetitive, keep the parsed values of the most recent strings
+DATE_CACHE_SIZE = 65536
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def date_info(string):
+    # (is_date, parsed date) of a value
+    return is_date(string), parse_date(string)
+
+def infer_date_format(values, sample=1000):
+    # Format of the first value (among the first rows) which matches one of the DATE_FORMATS
+    for v in values.iloc[:sample].tolist():
+        for sep, formats in DATE_FORMATS.items():
+            if len(v.split(sep)) == 3:
+                for fmt in formats:
+                    try:
+                        time.strptime(v, fmt)
+                        return fmt
+                    except ValueError:
+                        pass
+                break
+    return None
+
+def to_date_array(values):
+    # Vectorized parse_date with the format inferred from the column, NaT where the value does not match it
+    fmt = infer_date_format(values)
+    if fmt is None:
+        return np.full(len(values), np.datetime64('NaT'), dtype='datetime64[ns]')
+    return pd.to_datetime(values, format=fmt, errors='coerce').to_numpy()
+
+def is_string_series(values):
+    # True when every element of the series is a python string (no NaN / None)
+    return infer_dtype(values, skipna=False) in ('string', 'empty')
+
+def to_float_array(values):
+    # Vectorized version of is_digit / float(): returns the float values and a mask of the parsable ones
+    arr = np.asarray(values, dtype=object)
+    try:
+        return arr.astype(float), np.ones(len(arr), dtype=bool)
+    except (ValueError, TypeError):
+        codes, uniques = pd.factorize(arr)
+        floats = np.full(len(uniques) + 1, np.nan)
+        parsed = np.zeros(len(uniques) + 1, dtype=bool)
+        for i, u in enumerate(uniques):
+            try:
+                floats[i] = float(u)
+                parsed[i] = True
+            except (ValueError, TypeError):
+                pass
+        # code -1 (missing values) points to the last, unparsed slot
+        return floats[codes], parsed[codes]
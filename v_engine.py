@@ -6,17 +6,151 @@
 # georgios mountzouris 2025 (gmountzouris@efka.gov.gr)
 #
 
-import csv
+import io
+import os
+import pickle
+import hashlib
 import threading
 import functools
+import multiprocessing
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from collections import namedtuple
+from v_rule import ValueRange, RuleErrors
+from v_anomaly import AnomalyStore
+
+
+# Compiled form of the rule set, built by RuleEngine.compile()
+RuleEntry = namedtuple('RuleEntry', ['index', 'rule', 'column', 'col_idx', 'value_range'])
+ExecutionPlan = namedtuple('ExecutionPlan', ['logical_operator', 'cross_validation_key', 'entries', 'single_rules', 'column_groups', 'cross_validation'])
+
+# Rules without kernel are applied value by value in blocks of this size (error threshold checks in between)
+EVALUATION_BLOCK = 65536
+# Rows per block read in stream mode
+STREAM_CHUNK_SIZE = 100000
+# Minimum size of the byte range of a worker in parallel stream mode
+MIN_RANGE_SIZE = 8 * 1024 * 1024
+# Minimum number of rows of a worker task in parallel in-memory mode
+MIN_RANGE_ROWS = 50000
+# Rows per block of the dataframe fingerprint
+FINGERPRINT_BLOCK = 1000000
+
+
+class ByteRange(io.RawIOBase):
+    # Read only view of the bytes [start, end) of a file
+    def __init__(self, filename, start, end):
+        self.file = open(filename, 'rb')
+        self.file.seek(start)
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self.remaining)
+        if n <= 0:
+            return 0
+        data = self.file.read(n)
+        b[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+def split_byte_ranges(filename, n):
+    # Split the data rows of a csv file (after the header line) into at most n byte ranges aligned to line boundaries.
+    # Quoted values containing line breaks are not supported.
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        f.readline()
+        header_end = f.tell()
+        bounds = [header_end]
+        for k in range(1, n):
+            pos = header_end + (size - header_end) * k // n
+            if pos <= bounds[-1]:
+                continue
+            f.seek(pos - 1)
+            f.readline()
+            if f.tell() >= size:
+                break
+            if f.tell() > bounds[-1]:
+                bounds.append(f.tell())
+    bounds.append(size)
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1) if bounds[i + 1] > bounds[i]]
+
+
+def dataframe_fingerprint(df):
+    # Digest of the column names and the row hashes of pandas (computed block by block), used to check that the
+    # client and the servers loaded the same data. The same for object and Arrow string columns.
+    digest = hashlib.sha256(repr([str(c) for c in df.columns]).encode())
+    for start in range(0, len(df), FINGERPRINT_BLOCK):
+        digest.update(pd.util.hash_pandas_object(df.iloc[start:start + FINGERPRINT_BLOCK], index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def legacy_dataframe_hash(df):
+    # Dataframe hash of the previous versions (sha256 of the json encoding), for the peers of the v1 protocol
+    return hashlib.sha256(df.to_json().encode()).hexdigest()
+
+
+class DataframeHashes():
+    # Hashes of a dataframe, computed once (the threads asking for the same hash wait for it) and shared by an engine
+    # and its sessions
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.locks = {}
+        self.values = {}
+
+    def get(self, df, function):
+        with self.lock:
+            lock = self.locks.setdefault(function, threading.Lock())
+        with lock:
+            if function not in self.values:
+                self.values[function] = function(df)
+            return self.values[function]
+
+    def __getstate__(self):
+        # The locks are not picklable (copies of the engine are sent to the stream worker processes)
+        return {'values': self.values}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.values.update(state['values'])
+
+
+# Engine of a stream worker process (set by the pool initializer)
+stream_worker_engine = None
+
+def stream_worker_init(engine):
+    global stream_worker_engine
+    stream_worker_engine = engine
+
+def stream_worker(filename, sep, start, end, chunksize, encoding):
+    return stream_worker_engine.fire_byte_range(filename, sep, start, end, chunksize, encoding)
+
+
+# Engine (with its dataframe) and work units of an in-memory worker process, inherited with fork
+memory_worker_state = None
+
+def memory_worker_init(engine, units):
+    global memory_worker_state
+    memory_worker_state = (engine, units)
+
+def memory_worker(unit, start, stop):
+    engine, units = memory_worker_state
+    return engine.fire_unit(units[unit], start, stop)
 
 
 class RuleEngine():
     def __init__(self):
+        self.plan = None
         self.rules = []
         self.columns_to_check = []
         self.acceptable_values = []
-        self.anomalies = {}
+        self.anomalies = AnomalyStore()
         self.cross_validation = []
         #self.process_flag = False
         #self.cv = threading.Condition()
@@ -26,12 +160,67 @@ class RuleEngine():
         self.rows = -1
         self.logical_operator = None
         self.outlier_detection_time = 0.0
+        # Per rule error accounting of the last run (rule index -> RuleErrors)
+        self.rule_errors = {}
+        # Error rate above which a rule is reported as misconfigured and skipped (None: never)
+        self.error_threshold = None
+        self.error_min_checks = 1000
+        # Stop evaluating a rule on a column once its anomaly cap is reached (only the counts are needed, see set_anomaly_limits)
+        self.counts_only = False
         self.df = None
 
+    def __getstate__(self):
+        # The lock is not picklable (copies of the engine are sent to the stream worker processes)
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+
+    @property
+    def df(self):
+        return self._df
+
+    @df.setter
+    def df(self, df):
+        # Column indexes of the plan and the hashes depend on the dataframe
+        self._df = df
+        self.plan = None
+        self.hashes = DataframeHashes()
+
+    def session(self):
+        # New engine over the same dataframe (read only, hashes shared) with its own rules, cursors and results,
+        # e.g. for a client of the server
+        engine = RuleEngine()
+        engine.df = self._df
+        engine.hashes = self.hashes
+        engine.error_threshold = self.error_threshold
+        engine.error_min_checks = self.error_min_checks
+        engine.set_anomaly_limits(self.anomalies.max_per_column, self.anomalies.max_total, self.anomalies.sample_size, self.counts_only)
+        return engine
+
+    @property
+    def fingerprint(self):
+        # Fingerprint of the dataframe (see dataframe_fingerprint), computed once per dataframe
+        if self._df is None:
+            return None
+        return self.hashes.get(self._df, dataframe_fingerprint)
+
+    @property
+    def legacy_fingerprint(self):
+        # Hash of the previous versions (see legacy_dataframe_hash), computed once per dataframe when a v1 peer asks for it
+        if self._df is None:
+            return None
+        return self.hashes.get(self._df, legacy_dataframe_hash)
+
     def set_df(self, df):
         self.df = df
     
     def add_rule(self, rule, column, value_range):
+        if not isinstance(value_range, ValueRange):
+            value_range = ValueRange(value_range)
         if column == "<<ALL>>":
             all_columns = list(self.df)
             for c in all_columns:
@@ -40,19 +229,47 @@ class RuleEngine():
             self.rules.append(rule)
             self.columns_to_check.append(column)
             self.acceptable_values.append(value_range)
+            self.plan = None
 
     def add_cross_validation(self, i_when, i_then):
         self.cross_validation.append((i_when, i_then))
+        self.plan = None
 
     def delete_rule(self, index):
         del self.rules[index]
         del self.columns_to_check[index]
         del self.acceptable_values[index]
+        self.plan = None
 
     def modify_rule(self, index, rule, column, value_range):
+        if not isinstance(value_range, ValueRange):
+            value_range = ValueRange(value_range)
         self.rules[index] = rule
         self.columns_to_check[index] = column
         self.acceptable_values[index] = value_range
+        self.plan = None
+
+    def compile(self):
+        # Build (once) the execution plan of the rule set: column indexes resolved, rules grouped by column
+        # and cross validation rules separated. The logical operator and the cross validation list can be
+        # changed directly by the caller, so they are part of the plan key.
+        cross_validation_key = tuple(self.cross_validation)
+        if self.plan is not None and self.plan.logical_operator == self.logical_operator and self.plan.cross_validation_key == cross_validation_key:
+            return self.plan
+        entries = tuple(RuleEntry(i, r, c, self.df.columns.get_loc(c), self.acceptable_values[i]) for i, (r, c) in enumerate(zip(self.rules, self.columns_to_check)))
+        cv_rules = set(item for t in self.cross_validation for item in t)
+        cv_columns = set(self.columns_to_check[item] for item in cv_rules)
+        single_rules = tuple(e for e in entries if e.index not in cv_rules)
+        column_groups = []
+        for column in dict.fromkeys(self.columns_to_check):
+            if column not in cv_columns:
+                column_entries = tuple(e for e in entries if e.column == column)
+                column_groups.append((column, column_entries[0].col_idx, column_entries))
+        cross_validation = ()
+        if len(self.rules) >= 2:
+            cross_validation = tuple((entries[i_when], entries[i_then]) for i_when, i_then in self.cross_validation)
+        self.plan = ExecutionPlan(self.logical_operator, cross_validation_key, entries, single_rules, tuple(column_groups), cross_validation)
+        return self.plan
 
     def anomaly_detection(self, column, result, is_dictionary=False):
         if is_dictionary:
@@ -61,12 +278,7 @@ class RuleEngine():
             #    self.cv.wait()
             #self.process_flag = True
             with self.lock:
-                for k, v in result.items():
-                    invalid_list = [tuple(val) for val in v]
-                    if not k in self.anomalies:
-                        self.anomalies[k] = invalid_list
-                    else:
-                        self.anomalies[k] += invalid_list
+                self.anomalies.update(result)
             #self.process_flag = False
             #self.cv.notify_all()
             #self.cv.release()
@@ -78,33 +290,109 @@ class RuleEngine():
                 #    self.cv.wait()
                 #self.process_flag = True
                 with self.lock:
-                    if not column in self.anomalies:
-                        self.anomalies[column] = invalid_list
-                    else:
-                        self.anomalies[column] += invalid_list
+                    self.anomalies.update({column: invalid_list})
                 #self.process_flag = False
                 #self.cv.notify_all()
                 #self.cv.release()
 
+    def set_anomaly_limits(self, max_per_column=None, max_total=None, sample_size=0, counts_only=False):
+        # Past the caps the invalid values are only counted, plus a random sample of sample_size rows per column
+        self.anomalies.max_per_column = max_per_column
+        self.anomalies.max_total = max_total
+        self.anomalies.sample_size = sample_size
+        self.counts_only = counts_only
+
+    def anomaly_detection_mask(self, column, values, mask, offset=None, reference=True, sink=None, rule=None):
+        # values: the checked column slice, mask: boolean array of the valid values,
+        # offset: row number of the first value of the slice (default: after the result cursor), rule: name of the failed rule
+        # The invalid values are kept by reference into the column slice (only the row numbers are stored),
+        # unless reference is False (the slice is not kept alive, e.g. a block of a streamed file).
+        # With a sink, the invalid values are not stored but passed to sink(column, rows, values, rule).
+        invalid_positions = np.flatnonzero(~mask)
+        if len(invalid_positions) > 0:
+            if offset is None:
+                offset = 1 + self.result_cursor
+            if sink is not None:
+                sink(column, invalid_positions + offset, values.iloc[invalid_positions].tolist(), rule)
+                return
+            with self.lock:
+                if reference:
+                    self.anomalies.add_reference(column, invalid_positions + offset, values, offset, rule)
+                else:
+                    self.anomalies.add(column, invalid_positions + offset, values.iloc[invalid_positions].tolist(), rule)
+
+    def get_rule_errors(self, entry):
+        errors = self.rule_errors.get(entry.index)
+        if errors is None:
+            errors = self.rule_errors.setdefault(entry.index, RuleErrors(entry.rule.name, entry.column, self.error_threshold, self.error_min_checks))
+        return errors
+
+    def log_rule_errors(self):
+        # One line per rule instead of one line per failed value
+        for errors in self.rule_errors.values():
+            if errors.count > 0:
+                print(errors)
+
+    def evaluate_rule(self, entry, values):
+        # Use the vectorized kernel of the rule if it exists, otherwise apply the rule function on every value.
+        # Returns the boolean mask of the valid values, or None when the rule is misconfigured.
+        errors = self.get_rule_errors(entry)
+        if errors.misconfigured:
+            return None
+        mask = entry.rule.apply_kernel(values, entry.value_range)
+        if mask is not None:
+            errors.checked += len(values)
+            return mask
+        mask = np.empty(len(values), dtype=bool)
+        values_list = values.tolist()
+        for start in range(0, len(values_list), EVALUATION_BLOCK):
+            block = values_list[start:start + EVALUATION_BLOCK]
+            mask[start:start + len(block)] = np.fromiter((entry.rule.apply(v, entry.value_range, errors)[1] != False for v in block), dtype=bool, count=len(block))
+            errors.checked += len(block)
+            if errors.misconfigured:
+                return None
+        return mask
+
+    # The logical operators work on the boolean masks of the valid values
     def op_and(self, x, y):
-        #res = [(lambda f, s: (f[0], f[1] and s[1]))(j, k) for j, k in zip(x, y)] #lambda function in list comprehension#
-        res = [(j[0], j[1] and k[1]) for j, k in zip(x, y)]
-        return res
+        return np.logical_and(x, y)
     
     def op_or(self, x, y):
-        #res = [(lambda f, s: (f[0], f[1] or s[1]))(j, k) for j, k in zip(x, y)] #lambda function in list comprehension#
-        res = [(j[0], j[1] or k[1]) for j, k in zip(x, y)]
-        return res
+        return np.logical_or(x, y)
     
     def op_xor(self, x, y):
-        #res = [(lambda f, s: (f[0], f[1] != s[1]))(j, k) for j, k in zip(x, y)] #lambda function in list comprehension#
-        res = [(j[0], j[1] != k[1]) for j, k in zip(x, y)]
-        return res
+        return np.logical_xor(x, y)
 
     def logical_operator_apply(self, op, *argv):
         res = functools.reduce(op, argv)
         return res
 
+    def aggregate_rules(self, entries, values, operator):
+        # Mask of the valid values of a column group under the logical operator, None if no rule could be applied.
+        # AND evaluates the next rules only on the rows which are still valid, OR only on the rows which are still invalid.
+        result = None
+        for entry in entries:
+            if result is None or operator == "XOR":
+                mask = self.evaluate_rule(entry, values)
+                if mask is not None:
+                    result = mask.copy() if result is None else self.op_xor(result, mask)
+                continue
+            undecided = result if operator == "AND" else ~result
+            n = np.count_nonzero(undecided)
+            if n == 0:
+                break
+            if n < len(values) // 2:
+                # Both for AND (undecided: True) and OR (undecided: False) the new result of an undecided row is the rule result
+                positions = np.flatnonzero(undecided)
+                mask = self.evaluate_rule(entry, values.iloc[positions])
+                if mask is not None:
+                    result[positions] = mask
+            else:
+                mask = self.evaluate_rule(entry, values)
+                if mask is not None:
+                    result = self.op_and(result, mask) if operator == "AND" else self.op_or(result, mask)
+        return result
+
     def clear(self):
         self.rules.clear()
         self.columns_to_check.clear()
@@ -112,10 +400,12 @@ class RuleEngine():
         self.cross_validation.clear()
         self.parallel_init()
         self.logical_operator = None
+        self.plan = None
 
     def clear_outliers(self):
         with self.lock:
             self.anomalies.clear()
+        self.rule_errors = {}
         self.outlier_detection_time = 0.0
 
     def parallel_init(self):
@@ -125,218 +415,260 @@ class RuleEngine():
         self.data_cursor = 0
         self.rows = -1
 
-    def fire_all_rules(self):
+    def fire_block(self, plan, get_values, offset, reference=True, sink=None):
+        # Vectorized evaluation of the plan on a block of rows: get_values(col_idx) returns the values of the column
+        # in the block, offset is the row number of the first row of the block
+        early_exit = sink is None and self.counts_only and self.anomalies.capped
 
-        def fire_without_op(i, column):
-            column_values = (self.df[column][self.data_cursor:self.rows]).tolist()
-            result = list(map(functools.partial(self.rules[i].apply, value_range=self.acceptable_values[i]), column_values))
-            # Alternative version
-            """
-            result = []
-            for v in column_values:
-                result.append(self.rules[i].apply(value=v, value_range=self.acceptable_values[i]))
-            """
-            self.anomaly_detection(column, result)
+        # Get the invalid values from cross validation: rows where the "when" rule holds and the "then" rule fails.
+        # Every rule is evaluated once as a column mask, so the pairs sharing a "when" rule reuse its mask.
+        masks = {}
+        def cross_validation_mask(entry):
+            if entry.index not in masks:
+                masks[entry.index] = self.evaluate_rule(entry, get_values(entry.col_idx))
+            return masks[entry.index]
+        for when, then in plan.cross_validation:
+            when_mask = cross_validation_mask(when)
+            if when_mask is None:
+                continue
+            then_mask = cross_validation_mask(then)
+            if then_mask is None:
+                continue
+            self.anomaly_detection_mask(then.column, get_values(then.col_idx), ~(when_mask & ~then_mask), offset, reference, sink, f"{then.rule.name} (when {when.rule.name})")
 
-        shift = 1
+        # Simple rule set (the cross validation rules are ignored)
+        if not plan.logical_operator:
+            for entry in plan.single_rules:
+                if early_exit and self.anomalies.is_full(entry.column):
+                    # Only the counts are needed, stop evaluating the rule once the anomaly cap of the column is reached
+                    self.anomalies.column(entry.column).partial = True
+                    continue
+                column_values = get_values(entry.col_idx)
+                mask = self.evaluate_rule(entry, column_values)
+                if mask is not None:
+                    self.anomaly_detection_mask(entry.column, column_values, mask, offset, reference, sink, entry.rule.name)
+        # Rule set with logical operator
+        elif plan.logical_operator in ("AND", "OR", "XOR"):
+            # Apply the rule functions over the column set (cross validation columns excluded) and combine the results by column
+            for column, col_idx, entries in plan.column_groups:
+                column_values = get_values(col_idx)
+                mask = self.aggregate_rules(entries, column_values, plan.logical_operator)
+                if mask is not None:
+                    self.anomaly_detection_mask(column, column_values, mask, offset, reference, sink, f" {plan.logical_operator} ".join(e.rule.name for e in entries))
+
+    def fire_rows(self, plan, start, stop, sink=None):
+        # Check the dataframe rows [start, stop), numbered after the result cursor
+        # With the counts only option the rows are checked in blocks, so the evaluation stops at the anomaly caps
+        block = max(stop - start, 1)
+        if self.counts_only and self.anomalies.capped:
+            block = EVALUATION_BLOCK
+        for first in range(start, stop, block):
+            last = min(first + block, stop)
+            self.fire_block(plan, lambda col_idx: self.df.iloc[first:last, col_idx], 1 + self.result_cursor + first - self.data_cursor, sink=sink)
+
+    def fire_all_rules(self, sink=None):
+        # sink: optional callable sink(column, rows, values, rule), receives the invalid values as they are found instead of self.anomalies
+        plan = self.compile()
         self.clear_outliers()
         if self.rows == -1:
             self.rows = self.df.shape[0]
+        self.fire_rows(plan, self.data_cursor, self.rows, sink)
+        self.log_rule_errors()
 
-        # Get the invalid values from cross validation
-        if self.cross_validation and len(self.rules) >= 2:
-            for i_when, i_then in self.cross_validation:
-                when_col_idx = self.df.columns.get_loc(self.columns_to_check[i_when]) + shift
-                then_col_idx = self.df.columns.get_loc(self.columns_to_check[i_then]) + shift
-                for row in self.df[self.data_cursor:self.rows].itertuples():
-                    if self.rules[i_when].apply(row[when_col_idx], self.acceptable_values[i_when])[1] == True and self.rules[i_then].apply(row[then_col_idx], self.acceptable_values[i_then])[1] == False:
-                        invalid_list = [(row.Index + shift, row[then_col_idx])]
-                        with self.lock:
-                            if not self.columns_to_check[i_then] in self.anomalies:
-                                self.anomalies[self.columns_to_check[i_then]] = invalid_list
-                            else:
-                                self.anomalies[self.columns_to_check[i_then]] += invalid_list
-
-        cv_flat_list = None
-        # Simple rule set
-        if not self.logical_operator:
-            if self.cross_validation:
-                cv_flat_list = [item for t in self.cross_validation for item in t]
-            # Iterate over columns_to_check and apply the corresponding rule function
-            for i, c in enumerate(self.columns_to_check):
-                # If the column is in the cross validation, ignore it
-                if cv_flat_list:
-                    if i not in cv_flat_list:
-                        fire_without_op(i, c)
-                else:
-                    fire_without_op(i, c)
-        # Rule set with logical operator
+    def parallel_units(self, plan):
+        # Independent parts of the plan for the worker processes: the cross validation pairs (one unit, they share
+        # the rule masks), then the rules of every column (simple rule set) or every column group (logical operator)
+        units = []
+        if plan.cross_validation:
+            units.append(plan._replace(single_rules=(), column_groups=()))
+        if not plan.logical_operator:
+            for column in dict.fromkeys(e.column for e in plan.single_rules):
+                units.append(plan._replace(single_rules=tuple(e for e in plan.single_rules if e.column == column), column_groups=(), cross_validation=()))
+        elif plan.logical_operator in ("AND", "OR", "XOR"):
+            for group in plan.column_groups:
+                units.append(plan._replace(single_rules=(), column_groups=(group,), cross_validation=()))
+        return units
+
+    def fire_unit(self, plan, start, stop):
+        # In-memory worker: check the rows [start, stop) with a part of the plan.
+        # Returns the anomalies {column: (blocks, count, partial)} without the values (the parent has the same dataframe)
+        # and the rule errors.
+        self.clear_outliers()
+        self.fire_rows(plan, start, stop)
+        return self.export_anomalies(values=False), self.rule_errors
+
+    def fire_all_rules_parallel(self, workers=None, sink=None, shard_by='columns'):
+        # Parallel in-memory mode: the plan is split by column (group) and, when there are fewer units than workers
+        # (e.g. single column templates), by row range. With shard_by='rows' the whole plan is checked on every range:
+        # the rows [data_cursor, rows) are split into one range per worker (numbered after the result cursor, as in
+        # fire_all_rules). The worker processes are forked, so they share the dataframe instead of receiving a pickled copy.
+        # The results are merged in unit and row order.
+        # Falls back to fire_all_rules with one worker, few rows or without fork (the dataframe would be pickled).
+        plan = self.compile()
+        if self.rows == -1:
+            self.rows = self.df.shape[0]
+        workers = workers or os.cpu_count() or 1
+        if shard_by == 'rows':
+            units = [plan] if plan.entries else []
         else:
-            op = None
-            aggregation_result = None
-            # Get unique set of columns to check
-            colset = set(self.columns_to_check)
-            # Remove the cross validation columns from column set
-            if self.cross_validation:
-                colset_without_cv = set()
-                for col in colset:
-                    cv_flat_list = [self.columns_to_check[item] for t in self.cross_validation for item in t]
-                    if col not in cv_flat_list:
-                        colset_without_cv.add(col)
-                colset = colset_without_cv
-            # Iterate over column set and apply the corresponding rule function, group the results by column
-            total_results = [[list(map(functools.partial(self.rules[i].apply, value_range=self.acceptable_values[i]), self.df[c][self.data_cursor:self.rows].tolist())) for i, c in enumerate(self.columns_to_check) if c == x] for x in colset]
-            # Alternative version
-            """
-            total_results = []
-            for x in colset:
-                column_results = []
-                for i, c in enumerate(self.columns_to_check):
-                    if c == x:
-                        #rule_results = list(map(functools.partial(self.rules[i].apply, value_range=self.acceptable_values[i]), self.df[c][self.data_cursor:self.rows].tolist()))
-                        rule_results = []
-                        for v in self.df[c][self.data_cursor:self.rows].tolist():
-                            rule_results.append(self.rules[i].apply(v, self.acceptable_values[i]))
-                        column_results.append(rule_results)
-                if column_results:
-                    total_results.append(column_results)
-            """
-            # Set the logical operator function
-            if self.logical_operator == "AND":
-                op = self.op_and
-            elif self.logical_operator =="OR":
-                op = self.op_or
-            elif self.logical_operator =="XOR":
-                op = self.op_xor
-
-            if op:
-                # Apply logical operator function and reduce the results
-                aggregation_result = list(map(lambda x: self.logical_operator_apply(op, *x), total_results)) # Unpack the function arguments using the asterisk
-                # Alternative version
-                """
-                aggregation_result = []
-                for n in total_results:
-                    aggregation_result.append(self.logical_operator_apply(op, *n))
-                """
-            if aggregation_result:
-                # Finally get the invalid values
-                for col, res in zip(colset, aggregation_result):
-                    self.anomaly_detection(col, res)
-
-    def fire_all_rules_on_the_fly(self, filename, sep):
-        def add_to_anomalies(column, row_index, value):
-            invalid_tuple = (row_index, value)
-            if not column in self.anomalies:
-                self.anomalies[column] = [invalid_tuple]
-            else:
-                self.anomalies[column].append(invalid_tuple)
-        shift = 1
+            units = self.parallel_units(plan)
+        n_rows = self.rows - self.data_cursor
+        tasks = []
+        if units and workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            splits = max(1, min(-(-workers // len(units)), n_rows // MIN_RANGE_ROWS))
+            bounds = [self.data_cursor + n_rows * k // splits for k in range(splits + 1)]
+            tasks = [(unit, bounds[k], bounds[k + 1]) for unit in range(len(units)) for k in range(splits) if bounds[k + 1] > bounds[k]]
+        if len(tasks) < 2:
+            self.fire_all_rules(sink)
+            return
+        self.clear_outliers()
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=context, initializer=memory_worker_init, initargs=(self, units)) as executor:
+            futures = [executor.submit(memory_worker, unit, start, stop) for unit, start, stop in tasks]
+            for future in futures:
+                anomalies, rule_errors = future.result()
+                self.merge_results(anomalies, rule_errors, 0, sink)
+        self.log_rule_errors()
+
+    def stream_columns(self, plan):
+        # Indexes of the columns read in stream mode (the columns of the rules)
+        return sorted(set(e.col_idx for e in plan.entries))
+
+    def fire_blocks(self, plan, blocks, sink=None):
+        # Generator: check the blocks (dataframes of the stream columns, in order) with the vectorized rule path,
+        # yields the number of rows of every checked block
+        positions = {col_idx: i for i, col_idx in enumerate(self.stream_columns(plan))}
+        rows = 0
+        for block in blocks:
+            self.fire_block(plan, lambda col_idx: block.iloc[:, positions[col_idx]], 1 + rows, reference=False, sink=sink)
+            rows += len(block)
+            yield len(block)
+
+    def read_csv_blocks(self, plan, source, sep, chunksize, encoding, header, memory_map=False):
+        # Blocks of chunksize rows of a csv file (or file object), only the stream columns are read
+        return pd.read_csv(source, sep=sep, header=header, encoding=encoding, dtype=object, na_filter=False, usecols=self.stream_columns(plan), chunksize=chunksize, memory_map=memory_map)
+
+    def stream_blocks(self, plan, filename, sep, chunksize, encoding, memory_map, reader):
+        # reader: optional reader(usecols) -> dataframe blocks, for the files which are not csv (e.g. fixed width)
+        if reader is not None:
+            return reader(self.stream_columns(plan))
+        return self.read_csv_blocks(plan, filename, sep, chunksize, encoding, header=0, memory_map=memory_map)
+
+    def fire_all_rules_on_the_fly(self, filename, sep, chunksize=STREAM_CHUNK_SIZE, encoding='utf-8', sink=None, memory_map=False, reader=None):
+        # Stream mode: the file is read and checked block by block (memory_map: read the csv file through a memory map)
         if filename:
-            csv.field_size_limit(100000000)
-            with open(filename, "r") as csvfile:
-                datareader = csv.reader(csvfile, delimiter=sep)
-                next(datareader) #skip the header
-                for i, row in enumerate(datareader):
-                    if self.cross_validation and len(self.rules) >= 2:
-                        for i_when, i_then in self.cross_validation:
-                            when_col_idx = self.df.columns.get_loc(self.columns_to_check[i_when])
-                            then_col_idx = self.df.columns.get_loc(self.columns_to_check[i_then])
-                            if self.rules[i_when].apply(row[when_col_idx], self.acceptable_values[i_when])[1] == True and self.rules[i_then].apply(row[then_col_idx], self.acceptable_values[i_then])[1] == False:
-                                add_to_anomalies(self.columns_to_check[i_then], i + shift, row[then_col_idx])
-                    cv_flat_list = None
-                    if not self.logical_operator:
-                        if self.cross_validation:
-                            cv_flat_list = [item for t in self.cross_validation for item in t]
-                        for j, c in enumerate(self.columns_to_check):
-                            idx = self.df.columns.get_loc(c)
-                            res = ()
-                            if cv_flat_list:
-                                if j not in cv_flat_list:
-                                    res = self.rules[j].apply(value=row[idx], value_range=self.acceptable_values[j])
-                            else:
-                                res = self.rules[j].apply(value=row[idx], value_range=self.acceptable_values[j])
-                            if res and res[1] == False:
-                                add_to_anomalies(c, i + shift, res[0])
-                    else:
-                        colset = set(self.columns_to_check)
-                        if self.cross_validation:
-                            colset_without_cv = set()
-                            for col in colset:
-                                cv_flat_list = [self.columns_to_check[item] for t in self.cross_validation for item in t]
-                                if col not in cv_flat_list:
-                                    colset_without_cv.add(col)
-                            colset = colset_without_cv
-                        for x in colset:
-                            column_results = []
-                            for k, c in enumerate(self.columns_to_check):
-                                if x == c:
-                                    idx = self.df.columns.get_loc(c)
-                                    res = self.rules[k].apply(value=row[idx], value_range=self.acceptable_values[k])
-                                    column_results.append(res)
-                            if column_results:
-                                idx = self.df.columns.get_loc(x)
-                                if self.logical_operator == "AND":
-                                    total_result = all(b for v, b in column_results)
-                                elif self.logical_operator == "OR":
-                                    total_result = any(b for v, b in column_results)
-                                elif self.logical_operator == "XOR":
-                                    all_elements = (b for v, b in column_results)
-                                    total_result = functools.reduce(lambda a, b: a ^ b, all_elements)
-                                if total_result == False:
-                                    add_to_anomalies(x, i + shift, row[idx])
-"""
-    def fire_all_rules_on_the_fly_v2(self, filename, sep):
-            shift = 1
-            if filename:
-                with open(filename, "r") as csvfile:
-                    datareader = csv.reader(csvfile, delimiter=sep)
-                    next(datareader) #skip the header
-                    for i, row in enumerate(datareader):
-                        if self.cross_validation and len(self.rules) >= 2:
-                            for i_when, i_then in self.cross_validation:
-                                when_col_idx = self.df.columns.get_loc(self.columns_to_check[i_when])
-                                then_col_idx = self.df.columns.get_loc(self.columns_to_check[i_then])
-                                if self.rules[i_when].apply(row[when_col_idx], self.acceptable_values[i_when])[1] == True and self.rules[i_then].apply(row[then_col_idx], self.acceptable_values[i_then])[1] == False:
-                                    yield (self.columns_to_check[i_then], i + shift, row[then_col_idx])
-                        cv_flat_list = None
-                        if not self.logical_operator:
-                            if self.cross_validation:
-                                cv_flat_list = [item for t in self.cross_validation for item in t]
-                            for j, c in enumerate(self.columns_to_check):
-                                idx = self.df.columns.get_loc(c)
-                                res = ()
-                                if cv_flat_list:
-                                    if j not in cv_flat_list:
-                                        res = self.rules[j].apply(value=row[idx], value_range=self.acceptable_values[j])
-                                else:
-                                    res = self.rules[j].apply(value=row[idx], value_range=self.acceptable_values[j])
-                                if res[1] == False:
-                                    yield (c, i + shift, res[0])
+            plan = self.compile()
+            if plan.entries:
+                for rows in self.fire_blocks(plan, self.stream_blocks(plan, filename, sep, chunksize, encoding, memory_map, reader), sink):
+                    pass
+            self.log_rule_errors()
+
+    def fire_all_rules_on_the_fly_v2(self, filename, sep, chunksize=STREAM_CHUNK_SIZE, encoding='utf-8', batches=False, memory_map=False, reader=None):
+        # Generator version of the stream mode: the invalid values are not stored in self.anomalies but yielded
+        # after every checked block, as (column, row, value, rule) records or as (column, rows, values, rule) batches
+        if filename:
+            plan = self.compile()
+            if plan.entries:
+                found = []
+                sink = lambda column, rows, values, rule: found.append((column, rows, values, rule))
+                for rows in self.fire_blocks(plan, self.stream_blocks(plan, filename, sep, chunksize, encoding, memory_map, reader), sink):
+                    for column, invalid_rows, values, rule in found:
+                        if batches:
+                            yield (column, invalid_rows, values, rule)
                         else:
-                            colset = set(self.columns_to_check)
-                            if self.cross_validation:
-                                colset_without_cv = set()
-                                for col in colset:
-                                    cv_flat_list = [self.columns_to_check[item] for t in self.cross_validation for item in t]
-                                    if col not in cv_flat_list:
-                                        colset_without_cv.add(col)
-                                colset = colset_without_cv
-                            for x in colset:
-                                column_results = []
-                                for k, c in enumerate(self.columns_to_check):
-                                    if x == c:
-                                        idx = self.df.columns.get_loc(c)
-                                        res = self.rules[k].apply(value=row[idx], value_range=self.acceptable_values[k])
-                                        column_results.append(res)
-                                if column_results:
-                                    idx = self.df.columns.get_loc(x)
-                                    if self.logical_operator == "AND":
-                                        total_result = all(b for v, b in column_results)
-                                    elif self.logical_operator == "OR":
-                                        total_result = any(b for v, b in column_results)
-                                    elif self.logical_operator == "XOR":
-                                        all_elements = (b for v, b in column_results)
-                                        total_result = functools.reduce(lambda a, b: a ^ b, all_elements)
-                                    if total_result == False:
-                                        yield (x, i + shift, row[idx])
-"""
+                            for row, value in zip(invalid_rows.tolist(), values):
+                                yield (column, row, value, rule)
+                    found.clear()
+            self.log_rule_errors()
+
+    def fire_byte_range(self, filename, sep, start, end, chunksize, encoding):
+        # Stream worker: check the rows of the byte range [start, end) of the file (row numbers from 1).
+        # Returns the number of rows, the anomalies {column: (blocks, count, partial)} (see export_anomalies) and the rule errors.
+        plan = self.compile()
+        self.clear_outliers()
+        try:
+            rows = sum(self.fire_blocks(plan, self.read_csv_blocks(plan, io.BufferedReader(ByteRange(filename, start, end)), sep, chunksize, encoding, header=None)))
+        except pd.errors.EmptyDataError:
+            rows = 0
+        return rows, self.export_anomalies(), self.rule_errors
+
+    def export_anomalies(self, values=True):
+        # Anomalies of a worker process as {column: (blocks, count, partial)}, blocks: (rows, values, rule) as given by
+        # AnomalyColumn.iter_blocks. Without values (in-memory workers) only the row numbers are sent back.
+        return {column: (list(col.iter_blocks(values=values)), col.count, col.partial) for column, col in self.anomalies.items()}
+
+    def merge_results(self, anomalies, rule_errors, offset=0, sink=None):
+        # Merge the result of a worker process (see export_anomalies), its row numbers shifted by offset.
+        # The blocks without values are referenced into the dataframe of the engine (row numbers as in fire_rows).
+        for column, (blocks, count, partial) in anomalies.items():
+            received = 0
+            for rows, values, rule in blocks:
+                rows = rows + offset
+                if values is None:
+                    source, source_offset = self.df[column], 1 + self.result_cursor - self.data_cursor
+                if sink is not None:
+                    if values is None:
+                        values = source.iloc[rows - source_offset].tolist()
+                    if isinstance(rule, list):
+                        rules = np.array(rule, dtype=object)
+                        for name in dict.fromkeys(rule):
+                            positions = np.flatnonzero(rules == name)
+                            sink(column, rows[positions], [values[i] for i in positions], name)
+                    else:
+                        sink(column, rows, values, rule)
+                    continue
+                with self.lock:
+                    if values is None:
+                        self.anomalies.add_reference(column, rows, source, source_offset, rule)
+                    else:
+                        self.anomalies.add(column, rows, values, rule)
+                received += len(rows)
+            if sink is None:
+                with self.lock:
+                    self.anomalies.set_count(column, count, received, partial)
+        for index, errors in rule_errors.items():
+            self.rule_errors.setdefault(index, RuleErrors(errors.rule_name, errors.column, errors.threshold, errors.min_checks)).merge(errors)
+
+    def fire_all_rules_on_the_fly_parallel(self, filename, sep, workers=None, chunksize=STREAM_CHUNK_SIZE, encoding='utf-8', sink=None, memory_map=False):
+        # Parallel stream mode: the data rows of the file are split into byte ranges aligned to line boundaries,
+        # every range is checked by a worker process and the results are merged with the global row numbers.
+        # Falls back to fire_all_rules_on_the_fly when there is one range only or the rules cannot be sent to the workers.
+        if not filename:
+            return
+        plan = self.compile()
+        workers = workers or os.cpu_count() or 1
+        workers = min(workers, max(1, os.path.getsize(filename) // MIN_RANGE_SIZE))
+        ranges = split_byte_ranges(filename, workers) if plan.entries and workers > 1 else []
+        if len(ranges) < 2:
+            self.fire_all_rules_on_the_fly(filename, sep, chunksize, encoding, sink, memory_map)
+            return
+        # Copy of the engine without the data and the results
+        worker = RuleEngine()
+        worker.df = self.df.iloc[0:0]
+        for rule, column, value_range in zip(self.rules, self.columns_to_check, self.acceptable_values):
+            worker.add_rule(rule, column, value_range)
+        worker.cross_validation = list(self.cross_validation)
+        worker.logical_operator = self.logical_operator
+        worker.error_threshold = self.error_threshold
+        worker.error_min_checks = self.error_min_checks
+        worker.set_anomaly_limits(self.anomalies.max_per_column, self.anomalies.max_total, self.anomalies.sample_size, self.counts_only)
+        # With fork the workers inherit the engine, otherwise it is pickled (the rule kernels may be closures)
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing.get_context()
+            try:
+                pickle.dumps(worker)
+            except Exception as e:
+                print(f"Parallel stream mode is not available ({repr(e)}), running in a single process")
+                self.fire_all_rules_on_the_fly(filename, sep, chunksize, encoding, sink, memory_map)
+                return
+        with ProcessPoolExecutor(max_workers=len(ranges), mp_context=context, initializer=stream_worker_init, initargs=(worker,)) as executor:
+            futures = [executor.submit(stream_worker, filename, sep, start, end, chunksize, encoding) for start, end in ranges]
+            offset = 0
+            for future in futures:
+                rows, anomalies, rule_errors = future.result()
+                self.merge_results(anomalies, rule_errors, offset, sink)
+                offset += rows
+        self.log_rule_errors()
+
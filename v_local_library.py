@@ -8,7 +8,9 @@
 
 import re
 import math
-import time
+import operator
+import numpy as np
+import pandas as pd
 import v_common as common
 from v_rule import Rule
 from datetime import datetime
@@ -55,427 +57,286 @@ rule_library.append(rule)
 
 rule_library.clear()
 
+# Shared body of the *_date rules, the reference date is parsed once by the value range
+def compare_date(value, value_range, op):
+    ref_is_date, ref_date = value_range.dates[0]
+    value_is_date, value_date = common.date_info(value)
+    if value_is_date and ref_is_date:
+        if value_date is None or ref_date is None:
+            return False
+        return op(value_date, ref_date)
+    else:
+        return op(value, value_range[0])
+
+##################################################################
+# Vectorized kernels: kernel(series, value_range) -> boolean mask
+# of the valid values, same result as the rule function per value
+##################################################################
+
+def compare_kernel(op):
+    def kernel(values, value_range):
+        ref = value_range[0]
+        result = op(values, ref).to_numpy(dtype=bool, copy=True)
+        if value_range.floats[0] is not None:
+            floats, is_num = common.to_float_array(values)
+            result[is_num] = op(floats[is_num], value_range.floats[0])
+        return result
+    return kernel
+
+def range_kernel(values, value_range):
+    if value_range and len(value_range) == 2:
+        result = ((value_range[0] <= values) & (values <= value_range[1])).to_numpy(dtype=bool, copy=True)
+        if value_range.floats[0] is not None and value_range.floats[1] is not None:
+            floats, is_num = common.to_float_array(values)
+            low, high = value_range.floats
+            result[is_num] = (low <= floats[is_num]) & (floats[is_num] <= high)
+        return result
+    else:
+        return np.ones(len(values), dtype=bool)
+
+def not_range_kernel(values, value_range):
+    if value_range and len(value_range) == 2:
+        return ~range_kernel(values, value_range)
+    else:
+        return np.ones(len(values), dtype=bool)
+
+def optional_kernel(kernel):
+    # Rules which accept every value when the value range is empty
+    def wrapper(values, value_range):
+        if value_range:
+            return kernel(values, value_range)
+        else:
+            return np.ones(len(values), dtype=bool)
+    return wrapper
+
+def affix_kernel(method, negate=False):
+    def kernel(values, value_range):
+        if value_range:
+            result = np.logical_or.reduce([getattr(values.str, method)(s).to_numpy(dtype=bool) for s in value_range])
+            return ~result if negate else result
+        else:
+            return np.ones(len(values), dtype=bool)
+    return kernel
+
+def date_kernel(op):
+    def kernel(values, value_range):
+        if not value_range:
+            return np.ones(len(values), dtype=bool)
+        ref_is_date, ref_date = value_range.dates[0]
+        if not ref_is_date:
+            return op(values, value_range[0]).to_numpy(dtype=bool)
+        dates = common.to_date_array(values)
+        matched = ~np.isnat(dates)
+        result = np.zeros(len(values), dtype=bool)
+        if ref_date is not None:
+            result[matched] = op(dates[matched], np.datetime64(datetime(*ref_date[:3])))
+        # Values which do not match the column format go through the (cached) rule function
+        rest = np.flatnonzero(~matched)
+        if len(rest) > 0:
+            codes, uniques = pd.factorize(values.iloc[rest])
+            result[rest] = np.array([compare_date(u, value_range, op) for u in uniques], dtype=bool)[codes]
+        return result
+    return kernel
+
 ##################################################################
 
 # In value range [0]
 def in_value_range(value, value_range):
     if value_range and len(value_range) == 2:
-        if common.is_digit(value) and common.is_digit(value_range[0]) and common.is_digit(value_range[1]):
-            return float(value_range[0].replace(',', '.')) <= float(value.replace(',', '.')) <= float(value_range[1].replace(',', '.'))
+        if common.is_digit(value) and value_range.floats[0] is not None and value_range.floats[1] is not None:
+            return value_range.floats[0] <= float(value.replace(',', '.')) <= value_range.floats[1]
         else:
             return (value_range[0] <= value <= value_range[1])
     else:
         return True
 
-rule = Rule(name='in_value_range', descr='Check if the column values \nare in the given value range (e.g 10~100)', func=in_value_range)
+rule = Rule(name='in_value_range', descr='Check if the column values \nare in the given value range (e.g 10~100)', func=in_value_range, kernel=range_kernel)
 rule_library.append(rule)
 ##################################################################
 
 # In acceptable values [1]
 def in_acceptable_values(value, value_range):
     if value_range:
-        return (value in value_range)
+        return (value in value_range.members)
     else:
         return True
 
-rule = Rule(name='in_acceptable_values', descr='Check if the column contains \nonly the given acceptable values (e.g. 12,25,50,99)', func=in_acceptable_values)
+def in_acceptable_values_kernel(values, value_range):
+    if value_range:
+        return values.isin(value_range.members).to_numpy(dtype=bool)
+    else:
+        return np.ones(len(values), dtype=bool)
+
+rule = Rule(name='in_acceptable_values', descr='Check if the column contains \nonly the given acceptable values (e.g. 12,25,50,99)', func=in_acceptable_values, kernel=in_acceptable_values_kernel)
 rule_library.append(rule)
 ##################################################################
 
 # In value range [2]
 def not_in_value_range(value, value_range):
     if value_range and len(value_range) == 2:
-        if common.is_digit(value) and common.is_digit(value_range[0]) and common.is_digit(value_range[1]):
-            return not (float(value_range[0].replace(',', '.')) <= float(value.replace(',', '.')) <= float(value_range[1].replace(',', '.')))
+        if common.is_digit(value) and value_range.floats[0] is not None and value_range.floats[1] is not None:
+            return not (value_range.floats[0] <= float(value.replace(',', '.')) <= value_range.floats[1])
         else:
             return not (value_range[0] <= value <= value_range[1])
     else:
         return True
 
-rule = Rule(name='not_in_value_range', descr='Check if the column values \nare not in the given value range (e.g 10~100)', func=not_in_value_range)
+rule = Rule(name='not_in_value_range', descr='Check if the column values \nare not in the given value range (e.g 10~100)', func=not_in_value_range, kernel=not_range_kernel)
 rule_library.append(rule)
 ##################################################################
 
 # Not acceptable values [3]
 def not_acceptable_values(value, value_range):
     if value_range:
-        return not (value in value_range)
+        return not (value in value_range.members)
     else:
         return True
 
-rule = Rule(name='not_acceptable_values', descr='Check if the column contains \nvalues which are not in the given value list (e.g. 12,25,50,99)', func=not_acceptable_values)
+def not_acceptable_values_kernel(values, value_range):
+    if value_range:
+        return (~values.isin(value_range.members)).to_numpy(dtype=bool)
+    else:
+        return np.ones(len(values), dtype=bool)
+
+rule = Rule(name='not_acceptable_values', descr='Check if the column contains \nvalues which are not in the given value list (e.g. 12,25,50,99)', func=not_acceptable_values, kernel=not_acceptable_values_kernel)
 rule_library.append(rule)
 ##################################################################
 
 # Grater than [4]
 def greater_than(value, value_range):
-    if common.is_digit(value) and common.is_digit(value_range[0]):
-        return (float(value.replace(",", ".")) > float(value_range[0].replace(",", ".")))
+    if common.is_digit(value) and value_range.floats[0] is not None:
+        return (float(value.replace(",", ".")) > value_range.floats[0])
     else:
         return (value > value_range[0])
 
-rule = Rule(name='greater_than', descr='Check if the column values \nare greater than the given value', func=greater_than)
+rule = Rule(name='greater_than', descr='Check if the column values \nare greater than the given value', func=greater_than, kernel=compare_kernel(operator.gt))
 rule_library.append(rule)
 ##################################################################
 
 # Grater or equal [5]
 def greater_or_equal(value, value_range):
-    if common.is_digit(value) and common.is_digit(value_range[0]):
-        return (float(value.replace(",", ".")) >= float(value_range[0].replace(",", ".")))
+    if common.is_digit(value) and value_range.floats[0] is not None:
+        return (float(value.replace(",", ".")) >= value_range.floats[0])
     else:
         return (value >= value_range[0])
 
-rule = Rule(name='greater_or_equal', descr='Check if the column values \nare greater than or equal to the given value', func=greater_or_equal)
+rule = Rule(name='greater_or_equal', descr='Check if the column values \nare greater than or equal to the given value', func=greater_or_equal, kernel=compare_kernel(operator.ge))
 rule_library.append(rule)
 ##################################################################
 
 # Less than [6]
 def less_than(value, value_range):
-    if common.is_digit(value) and common.is_digit(value_range[0]):
-        return (float(value.replace(",", ".")) < float(value_range[0].replace(",", ".")))
+    if common.is_digit(value) and value_range.floats[0] is not None:
+        return (float(value.replace(",", ".")) < value_range.floats[0])
     else:
         return (value < value_range[0])
 
-rule = Rule(name='less_than', descr='Check if the column values \nare less than the given value', func=less_than)
+rule = Rule(name='less_than', descr='Check if the column values \nare less than the given value', func=less_than, kernel=compare_kernel(operator.lt))
 rule_library.append(rule)
 ##################################################################
 
 # Less or equal [7]
 def less_or_equal(value, value_range):
-    if common.is_digit(value) and common.is_digit(value_range[0]):
-        return (float(value.replace(",", ".")) <= float(value_range[0].replace(",", ".")))
+    if common.is_digit(value) and value_range.floats[0] is not None:
+        return (float(value.replace(",", ".")) <= value_range.floats[0])
     else:
         return (value <= value_range[0])
 
-rule = Rule(name='less_or_equal', descr='Check if the column values \nare less than or equal to the given value', func=less_or_equal)
+rule = Rule(name='less_or_equal', descr='Check if the column values \nare less than or equal to the given value', func=less_or_equal, kernel=compare_kernel(operator.le))
 rule_library.append(rule)
 ##################################################################
 
 # equal [8]
 def equal_to(value, value_range):
     if value_range:
-         if common.is_digit(value) and common.is_digit(value_range[0]):
-            return (float(value.replace(",", ".")) == float(value_range[0].replace(",", ".")))
+         if common.is_digit(value) and value_range.floats[0] is not None:
+            return (float(value.replace(",", ".")) == value_range.floats[0])
          else:
             return (value == value_range[0])
     else:
         return True
 
-rule = Rule(name='equal_to', descr='Check if the column values \nare equal to the given value', func=equal_to)
+rule = Rule(name='equal_to', descr='Check if the column values \nare equal to the given value', func=equal_to, kernel=optional_kernel(compare_kernel(operator.eq)))
 rule_library.append(rule)
 ##################################################################
 
 # Not equal [9]
 def not_equal_to(value, value_range):
     if value_range:
-        if common.is_digit(value) and common.is_digit(value_range[0]):
-            return (float(value.replace(",", ".")) != float(value_range[0].replace(",", ".")))
+        if common.is_digit(value) and value_range.floats[0] is not None:
+            return (float(value.replace(",", ".")) != value_range.floats[0])
         else:
             return (value != value_range[0])
     else:
         return True
 
-rule = Rule(name='not_equal_to', descr='Check if the column values \nare not equal to the given value', func=not_equal_to)
+rule = Rule(name='not_equal_to', descr='Check if the column values \nare not equal to the given value', func=not_equal_to, kernel=optional_kernel(compare_kernel(operator.ne)))
 rule_library.append(rule)
 ##################################################################
 
 # Grater than date [10]
 def greater_than_date(value, value_range):
     if value_range:
-        if common.is_date(value) and common.is_date(value_range[0]):
-            if len(value.split("/")) == 3:
-                try:
-                  value_date = time.strptime(value, "%d/%m/%Y")
-                except ValueError:
-                  try:
-                    value_date = time.strptime(value, "%Y/%m/%d")
-                  except ValueError:
-                    return False
-            elif len(value.split("-")) == 3:
-              try:
-                value_date = time.strptime(value, "%d-%m-%Y")
-              except ValueError:
-                try:
-                  value_date = time.strptime(value, "%Y-%m-%d")
-                except ValueError:
-                  return False
-            else:
-                return False
-            if len(value_range[0].split("/")) == 3:
-                try:
-                  value_range_date = time.strptime(value_range[0], "%d/%m/%Y")
-                except ValueError:
-                  try:
-                    value_range_date = time.strptime(value_range[0], "%Y/%m/%d")
-                  except ValueError:
-                    return False
-            elif len(value_range[0].split("-")) == 3:
-                try:
-                  value_range_date = time.strptime(value_range[0], "%d-%m-%Y")
-                except ValueError:
-                  try:
-                    value_range_date = time.strptime(value_range[0], "%Y-%m-%d")
-                  except ValueError:
-                    return False
-            else:
-                return False
-            return (value_date > value_range_date)
-        else:
-            return (value > value_range[0])
+        return compare_date(value, value_range, operator.gt)
     else:
         return True
 
-rule = Rule(name='greater_than_date', descr='Check if the column date values \nare greater than the given date value', func=greater_than_date)
+rule = Rule(name='greater_than_date', descr='Check if the column date values \nare greater than the given date value', func=greater_than_date, kernel=date_kernel(operator.gt))
 rule_library.append(rule)
 ##################################################################
 
 # Grater or equal date [11]
 def greater_or_equal_date(value, value_range):
     if value_range:
-        if common.is_date(value) and common.is_date(value_range[0]):
-            if len(value.split("/")) == 3:
-                try:
-                  value_date = time.strptime(value, "%d/%m/%Y")
-                except ValueError:
-                  try:
-                    value_date = time.strptime(value, "%Y/%m/%d")
-                  except ValueError:
-                    return False
-            elif len(value.split("-")) == 3:
-              try:
-                value_date = time.strptime(value, "%d-%m-%Y")
-              except ValueError:
-                try:
-                  value_date = time.strptime(value, "%Y-%m-%d")
-                except ValueError:
-                  return False
-            else:
-                return False
-            if len(value_range[0].split("/")) == 3:
-                try:
-                  value_range_date = time.strptime(value_range[0], "%d/%m/%Y")
-                except ValueError:
-                  try:
-                    value_range_date = time.strptime(value_range[0], "%Y/%m/%d")
-                  except ValueError:
-                    return False
-            elif len(value_range[0].split("-")) == 3:
-                try:
-                  value_range_date = time.strptime(value_range[0], "%d-%m-%Y")
-                except ValueError:
-                  try:
-                    value_range_date = time.strptime(value_range[0], "%Y-%m-%d")
-                  except ValueError:
-                    return False
-            else:
-                return False
-            return (value_date >= value_range_date)
-        else:
-            return (value >= value_range[0])
+        return compare_date(value, value_range, operator.ge)
     else:
         return True
 
-rule = Rule(name='greater_or_equal_date', descr='Check if the column date values \nare greater than or equal to the given date value', func=greater_or_equal_date)
+rule = Rule(name='greater_or_equal_date', descr='Check if the column date values \nare greater than or equal to the given date value', func=greater_or_equal_date, kernel=date_kernel(operator.ge))
 rule_library.append(rule)
 ##################################################################
 
 # Less than date [12]
 def less_than_date(value, value_range):
     if value_range:
-        if common.is_date(value) and common.is_date(value_range[0]):
-            if len(value.split("/")) == 3:
-                try:
-                  value_date = time.strptime(value, "%d/%m/%Y")
-                except ValueError:
-                  try:
-                    value_date = time.strptime(value, "%Y/%m/%d")
-                  except ValueError:
-                    return False
-            elif len(value.split("-")) == 3:
-              try:
-                value_date = time.strptime(value, "%d-%m-%Y")
-              except ValueError:
-                try:
-                  value_date = time.strptime(value, "%Y-%m-%d")
-                except ValueError:
-                  return False
-            else:
-                return False
-            if len(value_range[0].split("/")) == 3:
-                try:
-                  value_range_date = time.strptime(value_range[0], "%d/%m/%Y")
-                except ValueError:
-                  try:
-                    value_range_date = time.strptime(value_range[0], "%Y/%m/%d")
-                  except ValueError:
-                    return False
-            elif len(value_range[0].split("-")) == 3:
-                try:
-                  value_range_date = time.strptime(value_range[0], "%d-%m-%Y")
-                except ValueError:
-                  try:
-                    value_range_date = time.strptime(value_range[0], "%Y-%m-%d")
-                  except ValueError:
-                    return False
-            else:
-                return False
-            return (value_date < value_range_date)
-        else:
-            return (value < value_range[0])
+        return compare_date(value, value_range, operator.lt)
     else:
         return True
 
-rule = Rule(name='less_than_date', descr='Check if the column date values \nare less than the given date value', func=less_than_date)
+rule = Rule(name='less_than_date', descr='Check if the column date values \nare less than the given date value', func=less_than_date, kernel=date_kernel(operator.lt))
 rule_library.append(rule)
 ##################################################################
 
 # Less or equal date [13]
 def less_or_equal_date(value, value_range):
     if value_range:
-        if common.is_date(value) and common.is_date(value_range[0]):
-            if len(value.split("/")) == 3:
-                try:
-                  value_date = time.strptime(value, "%d/%m/%Y")
-                except ValueError:
-                  try:
-                    value_date = time.strptime(value, "%Y/%m/%d")
-                  except ValueError:
-                    return False
-            elif len(value.split("-")) == 3:
-              try:
-                value_date = time.strptime(value, "%d-%m-%Y")
-              except ValueError:
-                try:
-                  value_date = time.strptime(value, "%Y-%m-%d")
-                except ValueError:
-                  return False
-            else:
-                return False
-            if len(value_range[0].split("/")) == 3:
-                try:
-                  value_range_date = time.strptime(value_range[0], "%d/%m/%Y")
-                except ValueError:
-                  try:
-                    value_range_date = time.strptime(value_range[0], "%Y/%m/%d")
-                  except ValueError:
-                    return False
-            elif len(value_range[0].split("-")) == 3:
-                try:
-                  value_range_date = time.strptime(value_range[0], "%d-%m-%Y")
-                except ValueError:
-                  try:
-                    value_range_date = time.strptime(value_range[0], "%Y-%m-%d")
-                  except ValueError:
-                    return False
-            else:
-                return False
-            return (value_date <= value_range_date)
-        else:
-            return (value <= value_range[0])
+        return compare_date(value, value_range, operator.le)
     else:
         return True
 
-rule = Rule(name='less_or_equal_date', descr='Check if the column date values \nare less than or equal to the given date value', func=less_or_equal_date)
+rule = Rule(name='less_or_equal_date', descr='Check if the column date values \nare less than or equal to the given date value', func=less_or_equal_date, kernel=date_kernel(operator.le))
 rule_library.append(rule)
 ##################################################################
 
 # equal to date [14]
 def equal_to_date(value, value_range):
     if value_range:
-        if common.is_date(value) and common.is_date(value_range[0]):
-            if len(value.split("/")) == 3:
-                try:
-                  value_date = time.strptime(value, "%d/%m/%Y")
-                except ValueError:
-                  try:
-                    value_date = time.strptime(value, "%Y/%m/%d")
-                  except ValueError:
-                    return False
-            elif len(value.split("-")) == 3:
-              try:
-                value_date = time.strptime(value, "%d-%m-%Y")
-              except ValueError:
-                try:
-                  value_date = time.strptime(value, "%Y-%m-%d")
-                except ValueError:
-                  return False
-            else:
-                return False
-            if len(value_range[0].split("/")) == 3:
-                try:
-                  value_range_date = time.strptime(value_range[0], "%d/%m/%Y")
-                except ValueError:
-                  try:
-                    value_range_date = time.strptime(value_range[0], "%Y/%m/%d")
-                  except ValueError:
-                    return False
-            elif len(value_range[0].split("-")) == 3:
-                try:
-                  value_range_date = time.strptime(value_range[0], "%d-%m-%Y")
-                except ValueError:
-                  try:
-                    value_range_date = time.strptime(value_range[0], "%Y-%m-%d")
-                  except ValueError:
-                    return False
-            else:
-                return False
-            return (value_date == value_range_date)
-        else:
-            return (value == value_range[0])
+        return compare_date(value, value_range, operator.eq)
     else:
         return True
 
-rule = Rule(name='equal_to_date', descr='Check if the column date values \nare equal to the given date value', func=equal_to_date)
+rule = Rule(name='equal_to_date', descr='Check if the column date values \nare equal to the given date value', func=equal_to_date, kernel=date_kernel(operator.eq))
 rule_library.append(rule)
 ##################################################################
 
 # Not equal to date [15]
 def not_equal_to_date(value, value_range):
     if value_range:
-        if common.is_date(value) and common.is_date(value_range[0]):
-            if len(value.split("/")) == 3:
-                try:
-                  value_date = time.strptime(value, "%d/%m/%Y")
-                except ValueError:
-                  try:
-                    value_date = time.strptime(value, "%Y/%m/%d")
-                  except ValueError:
-                    return False
-            elif len(value.split("-")) == 3:
-              try:
-                value_date = time.strptime(value, "%d-%m-%Y")
-              except ValueError:
-                try:
-                  value_date = time.strptime(value, "%Y-%m-%d")
-                except ValueError:
-                  return False
-            else:
-                return False
-            if len(value_range[0].split("/")) == 3:
-                try:
-                  value_range_date = time.strptime(value_range[0], "%d/%m/%Y")
-                except ValueError:
-                  try:
-                    value_range_date = time.strptime(value_range[0], "%Y/%m/%d")
-                  except ValueError:
-                    return False
-            elif len(value_range[0].split("-")) == 3:
-                try:
-                  value_range_date = time.strptime(value_range[0], "%d-%m-%Y")
-                except ValueError:
-                  try:
-                    value_range_date = time.strptime(value_range[0], "%Y-%m-%d")
-                  except ValueError:
-                    return False
-            else:
-                return False
-            return (value_date != value_range_date)
-        else:
-            return (value != value_range[0])
+        return compare_date(value, value_range, operator.ne)
     else:
         return True
 
-rule = Rule(name='not_equal_to_date', descr='Check if the column date values \nare not equal to the given date value', func=not_equal_to_date)
+rule = Rule(name='not_equal_to_date', descr='Check if the column date values \nare not equal to the given date value', func=not_equal_to_date, kernel=date_kernel(operator.ne))
 rule_library.append(rule)
 ##################################################################
 
@@ -483,7 +344,10 @@ rule_library.append(rule)
 def is_null(value, value_range):
     return (value == "")
 
-rule = Rule(name='is_null', descr='Check if the column contains null values', func=is_null)
+def is_null_kernel(values, value_range):
+    return (values == "").to_numpy(dtype=bool)
+
+rule = Rule(name='is_null', descr='Check if the column contains null values', func=is_null, kernel=is_null_kernel)
 rule_library.append(rule)
 ##################################################################
 
@@ -491,7 +355,10 @@ rule_library.append(rule)
 def is_not_null(value, value_range):
     return (value != "")
 
-rule = Rule(name='is_not_null', descr='Check if the column contains not null values', func=is_not_null)
+def is_not_null_kernel(values, value_range):
+    return (values != "").to_numpy(dtype=bool)
+
+rule = Rule(name='is_not_null', descr='Check if the column contains not null values', func=is_not_null, kernel=is_not_null_kernel)
 rule_library.append(rule)
 ##################################################################
 
@@ -503,7 +370,10 @@ def is_numeric(value, value_range):
     except:
         return False
 
-rule = Rule(name='is_numeric', descr='Check if the column contains numeric values', func=is_numeric)
+def is_numeric_kernel(values, value_range):
+    return common.to_float_array(values.str.replace(',', '.', regex=False))[1]
+
+rule = Rule(name='is_numeric', descr='Check if the column contains numeric values', func=is_numeric, kernel=is_numeric_kernel)
 rule_library.append(rule)
 ##################################################################
 
@@ -515,7 +385,10 @@ def is_boolean(value, value_range):
             or value.upper() == 'YES' or value.upper() == 'NO' 
             or value.upper() == 'Y' or value.upper() == 'N')
 
-rule = Rule(name='is_boolean', descr='Check if the column contains boolean values', func=is_boolean)
+def is_boolean_kernel(values, value_range):
+    return (values.isin(['0', '1']) | values.str.upper().isin(['TRUE', 'FALSE', 'T', 'F', 'YES', 'NO', 'Y', 'N'])).to_numpy(dtype=bool)
+
+rule = Rule(name='is_boolean', descr='Check if the column contains boolean values', func=is_boolean, kernel=is_boolean_kernel)
 rule_library.append(rule)
 ##################################################################
 
@@ -523,7 +396,11 @@ rule_library.append(rule)
 def is_string(value, value_range):
     return isinstance(value, str)
 
-rule = Rule(name='is_string', descr='Check if the column contains string values', func=is_string)
+def is_string_kernel(values, value_range):
+    # Kernels only run on columns of python strings
+    return np.ones(len(values), dtype=bool)
+
+rule = Rule(name='is_string', descr='Check if the column contains string values', func=is_string, kernel=is_string_kernel)
 rule_library.append(rule)
 ##################################################################
 
@@ -534,63 +411,58 @@ def string_length_between(value, value_range):
     else:
         return True
 
-rule = Rule(name='string_length_between', descr='Check if the column contains string values \nwhich length is within the value range (e.g. 5~15)', func=string_length_between)
+def string_length_between_kernel(values, value_range):
+    if value_range and len(value_range) == 2:
+        lengths = values.str.len()
+        return ((int(value_range[0]) <= lengths) & (lengths <= int(value_range[1]))).to_numpy(dtype=bool)
+    else:
+        return np.ones(len(values), dtype=bool)
+
+rule = Rule(name='string_length_between', descr='Check if the column contains string values \nwhich length is within the value range (e.g. 5~15)', func=string_length_between, kernel=string_length_between_kernel)
 rule_library.append(rule)
 ##################################################################
 
 # Starts with [22]
 def starts_with(value, value_range):
     if value_range:
-        for s in value_range:
-            if value.startswith(s):
-                return True
-        return False
+        return value.startswith(value_range.affixes)
     else:
         return True
 
-rule = Rule(name='starts_with', descr='Check if the column contains values \nwhich start with one of the given values (e.g. GR,GRE,GRC)', func=starts_with)
+rule = Rule(name='starts_with', descr='Check if the column contains values \nwhich start with one of the given values (e.g. GR,GRE,GRC)', func=starts_with, kernel=affix_kernel('startswith'))
 rule_library.append(rule)
 ##################################################################
 
 # Ends with [23]
 def ends_with(value, value_range):
     if value_range:
-        for s in value_range:
-            if value.endswith(s):
-                return True
-        return False
+        return value.endswith(value_range.affixes)
     else:
         return True
 
-rule = Rule(name='ends_with', descr='Check if the column contains values \nwhich end with one of the given values (e.g. GR,GRE,GRC)', func=ends_with)
+rule = Rule(name='ends_with', descr='Check if the column contains values \nwhich end with one of the given values (e.g. GR,GRE,GRC)', func=ends_with, kernel=affix_kernel('endswith'))
 rule_library.append(rule)
 ##################################################################
 
 # Not starts with [24]
 def not_starts_with(value, value_range):
     if value_range:
-        for s in value_range:
-            if value.startswith(s):
-                return False
-        return True
+        return not value.startswith(value_range.affixes)
     else:
         return True
 
-rule = Rule(name='not_starts_with', descr='Check if the column contains values \nwhich not start with one of the given values (e.g. GR,GRE,GRC)', func=not_starts_with)
+rule = Rule(name='not_starts_with', descr='Check if the column contains values \nwhich not start with one of the given values (e.g. GR,GRE,GRC)', func=not_starts_with, kernel=affix_kernel('startswith', negate=True))
 rule_library.append(rule)
 ##################################################################
 
 # Not ends with [25]
 def not_ends_with(value, value_range):
     if value_range:
-        for s in value_range:
-            if value.endswith(s):
-                return False
-        return True
+        return not value.endswith(value_range.affixes)
     else:
         return True
 
-rule = Rule(name='not_ends_with', descr='Check if the column contains values \nwhich not end with one of the given values (e.g. GR,GRE,GRC)', func=not_ends_with)
+rule = Rule(name='not_ends_with', descr='Check if the column contains values \nwhich not end with one of the given values (e.g. GR,GRE,GRC)', func=not_ends_with, kernel=affix_kernel('endswith', negate=True))
 rule_library.append(rule)
 ##################################################################
 # No leading whitespace [26]
@@ -600,7 +472,10 @@ def no_leading_whitespace(value, value_range):
     else:
         return True
 
-rule = Rule(name='no_leading_whitespace', descr='Check if the column contains values \nwhich have no leading whitespace', func=no_leading_whitespace)
+def no_leading_whitespace_kernel(values, value_range):
+    return (~values.str[:1].isin(list(whitespace))).to_numpy(dtype=bool)
+
+rule = Rule(name='no_leading_whitespace', descr='Check if the column contains values \nwhich have no leading whitespace', func=no_leading_whitespace, kernel=no_leading_whitespace_kernel)
 rule_library.append(rule)
 ##################################################################
 
@@ -611,7 +486,10 @@ def no_trailing_whitespace(value, value_range):
     else:
         return True
 
-rule = Rule(name='no_trailing_whitespace', descr='Check if the column contains values \nwhich have no trailing whitespace', func=no_trailing_whitespace)
+def no_trailing_whitespace_kernel(values, value_range):
+    return (~values.str[-1:].isin(list(whitespace))).to_numpy(dtype=bool)
+
+rule = Rule(name='no_trailing_whitespace', descr='Check if the column contains values \nwhich have no trailing whitespace', func=no_trailing_whitespace, kernel=no_trailing_whitespace_kernel)
 rule_library.append(rule)
 ##################################################################
 
@@ -622,7 +500,10 @@ def no_inner_space(value, value_range):
     else:
         return True
 
-rule = Rule(name='no_inner_space', descr='Check if the column contains values \nwhich do not have inner whitespace', func=no_inner_space)
+def no_inner_space_kernel(values, value_range):
+    return (~values.str.strip().str.contains(r'\s', regex=True)).to_numpy(dtype=bool)
+
+rule = Rule(name='no_inner_space', descr='Check if the column contains values \nwhich do not have inner whitespace', func=no_inner_space, kernel=no_inner_space_kernel)
 rule_library.append(rule)
 ##################################################################
 
@@ -642,7 +523,10 @@ def no_inner_multispace(value, value_range):
     else:
         return True
 
-rule = Rule(name='no_inner_multispace', descr='Check if the column contains values \nwhich do not have multiple inner spaces', func=no_inner_multispace)
+def no_inner_multispace_kernel(values, value_range):
+    return (~values.str.strip().str.contains('  ', regex=False)).to_numpy(dtype=bool)
+
+rule = Rule(name='no_inner_multispace', descr='Check if the column contains values \nwhich do not have multiple inner spaces', func=no_inner_multispace, kernel=no_inner_multispace_kernel)
 rule_library.append(rule)
 ##################################################################
 
@@ -650,7 +534,10 @@ rule_library.append(rule)
 def no_space(value, value_range):
     return not (' ' in value)
 
-rule = Rule(name='no_space', descr='Check if the column contains values \nwhich do not have whitespaces', func=no_space)
+def no_space_kernel(values, value_range):
+    return (~values.str.contains(' ', regex=False)).to_numpy(dtype=bool)
+
+rule = Rule(name='no_space', descr='Check if the column contains values \nwhich do not have whitespaces', func=no_space, kernel=no_space_kernel)
 rule_library.append(rule)
 ##################################################################
 
@@ -658,7 +545,10 @@ rule_library.append(rule)
 def matches_decimal_format(value, value_range):
     return True if value and (len(value.split(',')[-1]) == 2) else False
 
-rule = Rule(name='matches_decimal_format', descr='Check if the column contains values \nwhich are float numbers with comma and 2 decimal places', func=matches_decimal_format)
+def matches_decimal_format_kernel(values, value_range):
+    return ((values != "") & (values.str.rpartition(',')[2].str.len() == 2)).to_numpy(dtype=bool)
+
+rule = Rule(name='matches_decimal_format', descr='Check if the column contains values \nwhich are float numbers with comma and 2 decimal places', func=matches_decimal_format, kernel=matches_decimal_format_kernel)
 rule_library.append(rule)
 ##################################################################
 
@@ -881,7 +771,11 @@ def is_alphabetic_string(value, value_range):
         return False
     else:
       return False
-rule = Rule(name='is_alphabetic_string', descr='Check if the column values \nare alphabetic strings', func=is_alphabetic_string)
+
+def is_alphabetic_string_kernel(values, value_range):
+    return ((values != "") & values.str.match("^[A-Za-z]*$")).to_numpy(dtype=bool)
+
+rule = Rule(name='is_alphabetic_string', descr='Check if the column values \nare alphabetic strings', func=is_alphabetic_string, kernel=is_alphabetic_string_kernel)
 rule_library.append(rule)
 ##################################################################
 
@@ -894,7 +788,11 @@ def is_alphanumeric_string(value, value_range):
         return False
     else:
       return False
-rule = Rule(name='is_alphanumeric_string', descr='Check if the column values \nare alphanumeric strings', func=is_alphanumeric_string)
+
+def is_alphanumeric_string_kernel(values, value_range):
+    return ((values != "") & values.str.match("^[A-Za-z0-9]*$")).to_numpy(dtype=bool)
+
+rule = Rule(name='is_alphanumeric_string', descr='Check if the column values \nare alphanumeric strings', func=is_alphanumeric_string, kernel=is_alphanumeric_string_kernel)
 rule_library.append(rule)
 ##################################################################
 
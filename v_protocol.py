@@ -0,0 +1,186 @@
+#
+# project: CSV Validator
+#
+# Wire Protocol v2
+#
+# georgios mountzouris 2025 (gmountzouris@efka.gov.gr)
+#
+
+import json
+import socket
+import struct
+import numpy as np
+
+# Optional compressors of the binary anomaly blocks
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+# A v2 connection starts with the HANDSHAKE string (answered with HANDSHAKE_OK by the servers which support it),
+# then every message is a frame: header (command length, payload length), command (utf-8) and payload (bytes).
+# There are no acknowledgements, the frames follow each other on the stream.
+# HANDSHAKE_OK is followed by the scheme of the dataframe hash of the server (#FINGERPRINT), without it the server
+# sends the hash of the previous versions (see RuleEngine.legacy_fingerprint), the same as in the v1 protocol.
+HANDSHAKE = "@PROTOCOL-V2@"
+HANDSHAKE_OK = "@PROTOCOL-V2-OK@"
+FINGERPRINT = "fingerprint"
+HEADER = struct.Struct('!HQ')
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+# Read timeout (seconds) of a connection once it is set up, long enough for the rules of a chunk (and the wait for a free
+# session of the server), the peers which disappear without closing are found earlier by the TCP keepalive probes
+READ_TIMEOUT = 3600
+KEEPALIVE_IDLE = 60
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 6
+# Payload size of the frames of a streamed message (e.g. the anomalies)
+FRAME_SIZE = 1024 * 1024
+FORMAT = "utf-8"
+
+# Binary anomaly block (payload of an ANOMALIES-BIN frame): compression code (1 byte), then, compressed,
+# the block header length (uint32), the block header (json: column, rows, rule names, value encoding),
+# the row numbers (int64, delta encoded), the rule codes (uint16, with more than one rule name) and the values
+# (utf-8: int64 offsets and the encoded strings, json: any other values, none: the rows only).
+COMPRESSIONS = {'none': 0, 'zstd': 1, 'lz4': 2}
+BLOCK_HEADER = struct.Struct('!I')
+
+
+def configure_socket(sock):
+    # Large buffers for the big payloads, no delay for the small command frames, keepalive probes for the lost peers
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # The keepalive timing options are not available on every platform
+    for option, value in (('TCP_KEEPIDLE', KEEPALIVE_IDLE), ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL), ('TCP_KEEPCNT', KEEPALIVE_COUNT)):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+def send_message(sock, command, payload=b''):
+    command = command.encode(FORMAT)
+    sock.sendall(HEADER.pack(len(command), len(payload)) + command)
+    if len(payload) > 0:
+        sock.sendall(payload)
+
+def recv_into(sock, view):
+    # Fill the (memoryview of the) buffer from the socket
+    while len(view) > 0:
+        n = sock.recv_into(view)
+        if n == 0:
+            raise ConnectionError("Connection closed by the peer")
+        view = view[n:]
+
+def recv_message(sock):
+    # Returns the command and the payload (memoryview of a buffer allocated once for the frame)
+    header = bytearray(HEADER.size)
+    recv_into(sock, memoryview(header))
+    command_size, payload_size = HEADER.unpack(header)
+    buffer = bytearray(command_size + payload_size)
+    recv_into(sock, memoryview(buffer))
+    return buffer[:command_size].decode(FORMAT), memoryview(buffer)[command_size:]
+
+def send_stream(sock, command, pieces, frame_size=FRAME_SIZE):
+    # Send a large payload given in pieces (bytes) as frames of about frame_size bytes, followed by an empty END frame
+    buffer = bytearray()
+    for piece in pieces:
+        buffer += piece
+        if len(buffer) >= frame_size:
+            send_message(sock, command, buffer)
+            buffer = bytearray()
+    if buffer:
+        send_message(sock, command, buffer)
+    send_message(sock, command + "-END")
+
+def recv_stream(sock, command):
+    # Generator of the payloads of a streamed message (see send_stream)
+    while True:
+        received, payload = recv_message(sock)
+        if received == command + "-END":
+            return
+        if received != command:
+            raise ValueError(f"Unexpected message {received} instead of {command}")
+        yield payload
+
+def available_compressions():
+    # In order of preference
+    compressions = []
+    if zstandard is not None:
+        compressions.append('zstd')
+    if lz4_frame is not None:
+        compressions.append('lz4')
+    return compressions
+
+def choose_compression(requested):
+    # First compression requested by the peer which is available here
+    available = available_compressions()
+    for compression in requested:
+        if compression in available:
+            return compression
+    return 'none'
+
+def compress(data, compression):
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=1).compress(data)
+    if compression == 'lz4':
+        return lz4_frame.compress(data)
+    return data
+
+def decompress(data, compression):
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    if compression == 'lz4':
+        return lz4_frame.decompress(data)
+    return data
+
+def encode_block(column, rows, values=None, rule=None, compression='none'):
+    # rows: int64 array, values: list or None (rows only), rule: name or list of names (one per row)
+    rows = np.asarray(rows, dtype=np.int64)
+    names = list(dict.fromkeys(rule)) if isinstance(rule, list) else [rule]
+    buffers = [np.diff(rows, prepend=np.int64(0)).astype('<i8').tobytes()]
+    if len(names) > 1:
+        codes = {name: i for i, name in enumerate(names)}
+        buffers.append(np.fromiter((codes[r] for r in rule), dtype='<u2', count=len(rows)).tobytes())
+    encoding = 'none'
+    if values is not None:
+        if all(isinstance(v, str) for v in values):
+            encoding = 'utf-8'
+            encoded = [v.encode(FORMAT, 'surrogatepass') for v in values]
+            offsets = np.zeros(len(encoded) + 1, dtype='<i8')
+            np.cumsum([len(v) for v in encoded], out=offsets[1:])
+            buffers += [offsets.tobytes(), b''.join(encoded)]
+        else:
+            encoding = 'json'
+            buffers.append(json.dumps(values).encode(FORMAT))
+    header = json.dumps({'column': column, 'rows': len(rows), 'rules': names, 'values': encoding}).encode(FORMAT)
+    data = b''.join([BLOCK_HEADER.pack(len(header)), header] + buffers)
+    return bytes([COMPRESSIONS[compression]]) + compress(data, compression)
+
+def decode_block(payload):
+    # Returns the column, the rows (int64 array), the values (list, None if not sent) and the rule (name or list)
+    payload = memoryview(payload)
+    compression = {code: name for name, code in COMPRESSIONS.items()}[payload[0]]
+    data = memoryview(decompress(payload[1:], compression))
+    header_size = BLOCK_HEADER.unpack_from(data)[0]
+    pos = BLOCK_HEADER.size + header_size
+    header = json.loads(bytes(data[BLOCK_HEADER.size:pos]).decode(FORMAT))
+    n = header['rows']
+    rows = np.cumsum(np.frombuffer(data, dtype='<i8', count=n, offset=pos)).astype(np.int64)
+    pos += 8 * n
+    names = header['rules']
+    rule = names[0]
+    if len(names) > 1:
+        rule = [names[c] for c in np.frombuffer(data, dtype='<u2', count=n, offset=pos).tolist()]
+        pos += 2 * n
+    values = None
+    if header['values'] == 'utf-8':
+        offsets = np.frombuffer(data, dtype='<i8', count=n + 1, offset=pos).tolist()
+        strings = bytes(data[pos + 8 * (n + 1):])
+        values = [strings[offsets[i]:offsets[i + 1]].decode(FORMAT, 'surrogatepass') for i in range(n)]
+    elif header['values'] == 'json':
+        values = json.loads(bytes(data[pos:]).decode(FORMAT))
+    return header['column'], rows, values, rule
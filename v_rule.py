@@ -6,15 +6,107 @@
 # georgios mountzouris 2025 (gmountzouris@efka.gov.gr)
 #
 
+import functools
+import numpy as np
+import v_common as common
+
+
 class Rule():
-    def __init__(self, name, descr, func):
+    def __init__(self, name, descr, func, kernel=None):
         self.name = name
         self.descr = descr
         self.func = func
+        # Optional vectorized version of func: kernel(series, value_range) -> boolean mask of the valid values
+        self.kernel = kernel
 
-    def apply(self, value, value_range):
+    def apply(self, value, value_range, errors=None):
         try:
             return (value, self.func(value, value_range))
         except Exception as e:
-            print(f"Error when applying the rule {self.name}. {self.func}, value: {value}, value_range: {value_range}: {repr(e)}")
+            # No output per failed value, the errors are counted (see RuleErrors)
+            if errors is not None:
+                errors.record(value, e)
             return (value, False)
+
+    def apply_kernel(self, values, value_range):
+        # Kernels are written for string columns, return None to fall back to the per value function
+        if self.kernel is None or not common.is_string_series(values):
+            return None
+        try:
+            mask = np.asarray(self.kernel(values, value_range), dtype=bool)
+            if mask.shape != (len(values),):
+                return None
+            return mask
+        except Exception:
+            return None
+
+
+class RuleErrors():
+    # Error accounting of a rule applied on a column: number of errors, the first sample values and the
+    # exception types. With a threshold (error rate), the rule is considered misconfigured once at least
+    # min_checks values have been checked and the error rate crosses the threshold.
+    SAMPLE_SIZE = 5
+
+    def __init__(self, rule_name, column, threshold=None, min_checks=1000):
+        self.rule_name = rule_name
+        self.column = column
+        self.threshold = threshold
+        self.min_checks = min_checks
+        self.checked = 0
+        self.count = 0
+        self.samples = []
+        self.types = {}
+
+    def record(self, value, e):
+        self.count += 1
+        if len(self.samples) < self.SAMPLE_SIZE:
+            self.samples.append(value)
+        name = type(e).__name__
+        self.types[name] = self.types.get(name, 0) + 1
+
+    def merge(self, other):
+        # Add the counters of the same rule checked on another part of the data
+        self.checked += other.checked
+        self.count += other.count
+        self.samples = (self.samples + other.samples)[:self.SAMPLE_SIZE]
+        for name, n in other.types.items():
+            self.types[name] = self.types.get(name, 0) + n
+
+    @property
+    def misconfigured(self):
+        return self.threshold is not None and self.checked >= self.min_checks and self.count >= self.threshold * self.checked
+
+    def __str__(self):
+        types = ', '.join(f"{k}: {v}" for k, v in self.types.items())
+        msg = f"Error when applying the rule {self.rule_name} on column {self.column}: {self.count} errors in {self.checked} values ({types}), sample values: {self.samples}"
+        if self.misconfigured:
+            msg += " -> misconfigured rule, skipped"
+        return msg
+
+
+class ValueRange(list):
+    # Value range of a rule: the given string values plus their parsed forms, which are computed once
+    # (on first use) instead of on every checked value. Treat it as immutable once it is given to the engine.
+    def __init__(self, values=(), source=None, inline=()):
+        super().__init__(values)
+        # File of the values when they are loaded from an external code list (as referenced in the template)
+        # and the values given inline next to it
+        self.source = source
+        self.inline = list(inline)
+
+    @functools.cached_property
+    def floats(self):
+        return tuple(float(v) if common.is_digit(v) else None for v in self)
+
+    @functools.cached_property
+    def dates(self):
+        # (is_date, parsed date) per value
+        return tuple(common.date_info(v) for v in self)
+
+    @functools.cached_property
+    def members(self):
+        return frozenset(self)
+
+    @functools.cached_property
+    def affixes(self):
+        return tuple(self)
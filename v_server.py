@@ -9,9 +9,10 @@
 import json
 import time
 import socket
-import hashlib
+import threading
 import pandas as pd
 import v_utilities as util
+import v_protocol as protocol
 from io import StringIO
 #from tqdm import tqdm
 
@@ -23,6 +24,66 @@ SIZE = 1024
 STRINGCHUNKSIZE = 512
 FORMAT = "utf-8"
 RUNFLAG = True
+# Maximum number of client sessions firing their rules at the same time (the next ones wait, still connected, for a free slot)
+MAX_SESSIONS = 4
+fire_slots = threading.BoundedSemaphore(MAX_SESSIONS)
+
+def load_rules(engine, vlib, xml_rules_string):
+    rules_attrib, xml_rules_list, cross_validation = util.import_from_xml_template(xml_rules_string, from_string=True)
+    op = str(None)
+    if "logical_operator" in rules_attrib:
+        op = rules_attrib['logical_operator']
+    if op == "AND" or op == "OR" or op == "XOR":
+        engine.logical_operator = op
+    for x in xml_rules_list:
+        for r in vlib.rule_library:
+            if x[1] == r.name:
+                engine.add_rule(rule=r, column=x[0], value_range=x[2])
+    for i_when, i_then in cross_validation:
+        engine.add_cross_validation(i_when, i_then)
+
+def load_dataframe(engine, df_string):
+    # The rules are received first: only their columns are loaded
+    columns = set(engine.columns_to_check) if engine.rules else None
+    df = pd.read_csv(StringIO(df_string), sep=';', header='infer', encoding='utf-8', dtype=object, na_filter=False, usecols=(lambda c: c in columns) if columns else None)
+    engine.df = util.get_df_as_type_string(df)
+
+def set_range(engine, cursor, chunk):
+    # The store of the previous run may be held by the callback (e.g. displayed by the GUI), a new one is used
+    engine.anomalies = engine.anomalies.empty_copy()
+    engine.clear()
+    engine.data_cursor = engine.result_cursor = cursor
+    # rows is the end of the row range (see RuleEngine.fire_all_rules), the client sends its size
+    engine.rows = engine.data_cursor + chunk
+
+def fire_rules(engine, callback):
+    # Fire the rules of the client, returns the pieces of the json encoding of the anomalies
+    anomalies_json = ["{}"]
+    if engine and len(engine.rules) > 0:
+        try:
+            with fire_slots:
+                start = time.time()
+                engine.fire_all_rules()
+                end = time.time()
+            if callback:
+                callback(engine.data_cursor + 1, engine.rows, end - start, engine.anomalies)
+            # The anomalies are encoded lazily, chunk by chunk
+            anomalies_json = engine.anomalies.iter_json()
+        except Exception as e:
+            print(f" -- Error while fire client rules and get the result in json: {repr(e)}")
+    return anomalies_json
+
+def send_binary_anomalies(client_socket, engine, callback, options):
+    # Fire the rules of the client and send the anomalies as binary blocks (see v_protocol.encode_block),
+    # then the total counts of the columns. Without values the client takes them from its own dataframe.
+    fire_rules(engine, callback)
+    compression = protocol.choose_compression(options.get('compression', []))
+    counts = []
+    for column, col in engine.anomalies.items():
+        for rows, values, rule in col.iter_blocks(values=options.get('values', True)):
+            protocol.send_message(client_socket, "ANOMALIES-BIN", protocol.encode_block(column, rows, values, rule, compression))
+        counts.append((column, col.count, col.partial))
+    protocol.send_message(client_socket, "ANOMALIES-BIN-END", json.dumps(counts).encode(FORMAT))
 
 def handle_rules(client_socket, engine, vlib):
     success_flag = True
@@ -35,18 +96,7 @@ def handle_rules(client_socket, engine, vlib):
                 break
             xml_rules_string += data
         if xml_rules_string:
-            rules_attrib, xml_rules_list, cross_validation = util.import_from_xml_template(xml_rules_string, from_string=True)
-            op = str(None)
-            if "logical_operator" in rules_attrib:
-                op = rules_attrib['logical_operator']
-            if op == "AND" or op == "OR" or op == "XOR":
-                engine.logical_operator = op
-            for x in xml_rules_list:
-                for r in vlib.rule_library:
-                    if x[1] == r.name:
-                        engine.add_rule(rule=r, column=x[0], value_range=x[2])
-            for i_when, i_then in cross_validation:
-                engine.add_cross_validation(i_when, i_then)
+            load_rules(engine, vlib, xml_rules_string)
     except Exception as e:
         print(f" --  Error while handling rules from client: {repr(e)}")
         success_flag = False
@@ -67,31 +117,28 @@ def handle_dataframe(client_socket, engine):
         print(f" -- Error while handling dataframe from client: {repr(e)}")
         success_flag = False
     if df_string:
-        df = pd.read_csv(StringIO(df_string), sep=';', header='infer', encoding='utf-8', dtype=object)
-        engine.df = util.get_df_as_type_string(df)
+        load_dataframe(engine, df_string)
     return success_flag
 
+def json_chunks(pieces, size):
+    # Fixed size chunks of a json text given in pieces
+    buffer = ""
+    for piece in pieces:
+        buffer += piece
+        n = len(buffer) - len(buffer) % size
+        for i in range(0, n, size):
+            yield buffer[i:i+size]
+        buffer = buffer[n:]
+    if buffer:
+        yield buffer
+
 def fire_all_client_rules(client_socket, engine, callback):
     success_flag = True
-    anomalies_json = "{}"
     try:
-        if engine and len(engine.rules) > 0:
-            try:
-                start = time.time()
-                engine.fire_all_rules()
-                end = time.time()
-                if callback:
-                    callback(engine.data_cursor + 1, engine.data_cursor + engine.rows, end - start)
-                anomalies_json = json.dumps(engine.anomalies)
-                #print(anomalies_json)
-            except Exception as e:
-                print(f" -- Error while fire client rules and get the result in json: {repr(e)}")
+        anomalies_json = fire_rules(engine, callback)
         client_socket.send("@ANOMALIES-START@".encode(FORMAT))
-        for i in range(0, len(anomalies_json), STRINGCHUNKSIZE*4):
+        for data in json_chunks(anomalies_json, STRINGCHUNKSIZE*4):
             msg = client_socket.recv(SIZE).decode(FORMAT)
-            data = anomalies_json[i:i+(STRINGCHUNKSIZE*4)]
-            if not data:
-                break
             client_socket.send(data.encode(FORMAT))
     except Exception as e:
         print(f" -- Error while handle anomalies: {repr(e)}")
@@ -103,17 +150,49 @@ def fire_all_client_rules(client_socket, engine, callback):
             pass
     return success_flag
 
+def handle_client_v2(client_socket, engine, vlib, callback):
+    # v2 protocol: length prefixed frames without acknowledgements (see v_protocol)
+    protocol.configure_socket(client_socket)
+    while True:
+        command, payload = protocol.recv_message(client_socket)
+        if command == "DATAFRAME-HASH":
+            protocol.send_message(client_socket, "DATAFRAME-HASH", engine.fingerprint.encode(FORMAT))
+        elif command == "RANGE":
+            cursor, chunk = bytes(payload).decode(FORMAT).split('#')
+            set_range(engine, int(cursor), int(chunk))
+        elif command == "RULES":
+            load_rules(engine, vlib, bytes(payload).decode(FORMAT))
+        elif command == "DATAFRAME":
+            load_dataframe(engine, bytes(payload).decode(FORMAT))
+        elif command == "FIRE":
+            options = json.loads(bytes(payload).decode(FORMAT)) if len(payload) > 0 else {}
+            if options.get('encoding') == 'binary':
+                send_binary_anomalies(client_socket, engine, callback, options)
+            else:
+                protocol.send_stream(client_socket, "ANOMALIES", (piece.encode(FORMAT) for piece in fire_rules(engine, callback)))
+        elif command == "CLOSE":
+            break
+
 def handle_client(client_socket, addr, engine, vlib, callback):
+    # A client which stops answering does not keep its session (and thread) forever
+    client_socket.settimeout(protocol.READ_TIMEOUT)
     try:
         """ Receiving from client. """
         success_flag = True
         while success_flag:
             data = client_socket.recv(SIZE).decode(FORMAT)
-            if data == "@STATUS@":
+            if not data:
+                # Connection closed by the client
+                break
+            if data == protocol.HANDSHAKE:
+                client_socket.send(f"{protocol.HANDSHAKE_OK}#{protocol.FINGERPRINT}".encode(FORMAT))
+                handle_client_v2(client_socket, engine, vlib, callback)
+                break
+            elif data == "@STATUS@":
                 client_socket.send("200".encode(FORMAT))
             elif data == "@DATAFRAME-HASH@":
-                df_hash = hashlib.sha256(engine.df.to_json().encode()).hexdigest()
-                client_socket.send(df_hash.encode(FORMAT))
+                # Clients of the v1 protocol compare the hash of the previous versions
+                client_socket.send(engine.legacy_fingerprint.encode(FORMAT))
             elif data == "@RULES-START@":
                 success_flag = handle_rules(client_socket, engine, vlib)
             elif data == "@DATAFRAME-START@":
@@ -122,35 +201,39 @@ def handle_client(client_socket, addr, engine, vlib, callback):
                 success_flag = fire_all_client_rules(client_socket, engine, callback)
             elif "CURSOR#" in data and "CHUNK#" in data:
                 items = data.split('@')
-                engine.clear()
-                engine.data_cursor = engine.result_cursor = int(items[0].split('#')[1])
-                engine.rows = int(items[1].split('#')[1])
+                set_range(engine, int(items[0].split('#')[1]), int(items[1].split('#')[1]))
                 client_socket.send("Cursor & chunk size received.".encode(FORMAT))
             elif data == "@CLOSE@":
                 break
     except Exception as e:
         print(f" -- Error while handling client connection: {repr(e)}")
     finally:
-        #engine.df = None
-        #engine.clear()
-        engine.parallel_init()
+        # The session is dropped with the connection, its anomalies are not cleared (the callback may hold them)
         client_socket.close()
         print(f" -- Connection to client ({addr[0]}:{addr[1]}) was closed")
 
-def main(engine, vlib, callback=None):
+def main(engine, vlib, callback=None, max_sessions=MAX_SESSIONS):
+    global fire_slots
+    fire_slots = threading.BoundedSemaphore(max_sessions)
     try:
         """ Creating a TCP server socket """
         server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # The accepted connections inherit the socket options
+        protocol.configure_socket(server)
         server.bind(ADDR)
         server.listen()
+        # The fingerprint of the loaded dataframe is computed once, before the first client asks for it
+        if engine.df is not None:
+            engine.fingerprint
         print(f"[+] Server listening on {IP}:{PORT}")
         while RUNFLAG:
             #print(f"[+] Waiting for client connection...")
             client_socket, addr = server.accept()
             """ Accepting the connection from the client. """
             print(f" -- Client connected from {addr[0]}:{addr[1]}")
-            # handle the client
-            handle_client(client_socket, addr, engine, vlib, callback)
+            # Every client has its own session (rules, cursor, chunk and results) over the dataframe of the server and its
+            # own thread: the handshake, the status and the hash are answered at once, only firing the rules waits for a slot
+            threading.Thread(target=handle_client, args=(client_socket, addr, engine.session(), vlib, callback), daemon=True).start()
     except Exception as e:
         print(f"An error has occured: {repr(e)}")
     finally:
@@ -7,7 +7,9 @@
 #
 
 import os, io, re
+import mmap
 import csv
+import json
 import pandas as pd
 import pandasql as ps
 import numpy as np
@@ -18,7 +20,9 @@ import xml.etree.ElementTree as ET
 import v_common as common
 import v_client as client
 from v_pgdev import Pgdev
+from v_rule import ValueRange
 from pathlib import Path
+from itertools import islice, repeat
 from xlsxwriter.color import Color
 from dateutil.parser import parse
 from v_outlier_detector import OutlierDetector
@@ -61,27 +65,85 @@ def print_result(anomalies):
         for val in v:
             print('\t-> Row: ' + str(val[0]) + '\tValue: ' + str(val[1]))
 
-def get_result(anomalies, actual_row_number=True):
+def get_result(anomalies, actual_row_number=True, max_rows=None):
+    # max_rows (summary mode): list only the first max_rows invalid values of every column
     add_header = 0
     if not actual_row_number:
         add_header = 1
     total = 0
     #result = '=======================\nValidation check result\n=======================\n'
     result = header_box('Validation check result')
-    header = '\n'
-    data = '\n'
+    header = ['\n']
+    data = ['\n']
     if len(anomalies) > 0:
         for k, v in anomalies.items():
             inv = len(v)
             total += inv
-            header += header_box(msg='[' + k + '] invalid values: ' + str(inv), width=50, character='-')
+            header.append(header_box(msg='[' + k + '] invalid values: ' + str(inv), width=50, character='-'))
             #header += '\n-----------------------'
-            data += '\n' + k + '\n'
-            for row, val in v:
-                data += '-> Row: ' + str(row+add_header) + ', Value: ' + str(val) + '\n'
-        result += header + data + '-------\n'
+            data.append('\n' + k + '\n')
+            shown = 0
+            for row, val in islice(v, max_rows):
+                data.append('-> Row: ' + str(row+add_header) + ', Value: ' + str(val) + '\n')
+                shown += 1
+            if shown < inv:
+                data.append('-> ... ' + str(inv - shown) + ' more invalid values\n')
+        result += ''.join(header) + ''.join(data) + '-------\n'
     return total, result
 
+class ResultWriter():
+    # Report of the invalid values as (column, row, value, rule) records, written through a buffered file
+    # in csv or json lines format. It can be the sink of a rule engine run (the records are written as they
+    # are found) or write the anomalies of a finished run, so the report is never held in memory.
+    def __init__(self, filename, format='csv', encoding='utf-8', row_shift=0):
+        self.format = format
+        self.row_shift = row_shift
+        self.count = 0
+        self.file = open(filename, 'w', encoding=encoding, newline='', buffering=1024*1024)
+        if format == 'csv':
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(['column', 'row', 'value', 'rule'])
+
+    def __call__(self, column, rows, values, rule=None):
+        rows = [int(row) + self.row_shift for row in rows]
+        rules = rule if isinstance(rule, list) else repeat(rule)
+        if self.format == 'csv':
+            self.writer.writerows(zip(repeat(column), rows, values, rules))
+        else:
+            # Only the values are encoded per record
+            prefix = '{"column": ' + json.dumps(column, ensure_ascii=False) + ', "row": '
+            encoded = {}
+            for row, value, r in zip(rows, values, rules):
+                if r not in encoded:
+                    encoded[r] = json.dumps(r, ensure_ascii=False)
+                self.file.write(prefix + str(row) + ', "value": ' + json.dumps(value, ensure_ascii=False) + ', "rule": ' + encoded[r] + '}\n')
+        self.count += len(rows)
+
+    def write(self, anomalies):
+        for column, v in anomalies.items():
+            if hasattr(v, 'iter_chunks'):
+                for rows, values, rules in v.iter_chunks(rules=True):
+                    self(column, rows, values, rules)
+            else:
+                for row, val in v:
+                    self(column, [row], [val])
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def write_result(filename, anomalies, actual_row_number=True, encoding='utf-8'):
+    # Write the anomalies to a csv or (.jsonl file) json lines report, returns the number of records
+    format = 'jsonl' if filename.lower().endswith(('.jsonl', '.json')) else 'csv'
+    with ResultWriter(filename, format, encoding, row_shift=0 if actual_row_number else 1) as writer:
+        writer.write(anomalies)
+    return writer.count
+
 def get_delimiter(filename):
     #read the first line of csv and identify the delimiter
     with open(filename, 'r') as f:
@@ -89,21 +151,64 @@ def get_delimiter(filename):
         dialect = sniffer.sniff(f.readline())
         return dialect.delimiter
 
-def get_dataframe(filename, delimiter=',', header='infer', encoding='utf-8', type=None, jlx_spec=None, fwf_spec=None, nrows=None):
+def read_csv_arrow(filename, delimiter=',', header='infer', encoding='utf-8', type=None, column_filter=None, na_filter=True):
+    # Multithreaded pyarrow parser, the string columns are kept as Arrow strings (no python object per value).
+    # Returns None when pyarrow is not available or fails on the file (the default parser is used instead).
+    df = None
+    try:
+        import pyarrow as pa
+        from pyarrow import csv as pa_csv
+        from pandas._libs.parsers import STR_NA_VALUES
+        # The column names as the default parser gives them (header or 0, 1, ...)
+        names = pd.read_csv(filename, sep=delimiter, header=header, encoding=encoding, nrows=0, na_filter=na_filter).columns.tolist()
+        columns = [c for c in names if column_filter is None or column_filter(c)]
+        read_options = pa_csv.ReadOptions(column_names=[str(c) for c in names], skip_rows=0 if header is None else 1, encoding=encoding)
+        parse_options = pa_csv.ParseOptions(delimiter=delimiter)
+        # The same null values as the default parser (none without NA filtering)
+        convert_options = pa_csv.ConvertOptions(include_columns=[str(c) for c in columns], null_values=list(STR_NA_VALUES) if na_filter else [], strings_can_be_null=na_filter)
+        types_mapper = None
+        if type in (object, str):
+            convert_options.column_types = {str(c): pa.string() for c in columns}
+            types_mapper = {pa.string(): pd.StringDtype("pyarrow")}.get
+        table = pa_csv.read_csv(filename, read_options=read_options, parse_options=parse_options, convert_options=convert_options)
+        df = table.to_pandas(types_mapper=types_mapper)
+        df.columns = columns
+    except Exception as e:
+        print(repr(e))
+    return df
+
+def get_dataframe(filename, delimiter=',', header='infer', encoding='utf-8', type=None, jlx_spec=None, fwf_spec=None, nrows=None, usecols=None, engine='c', na_filter=True):
+    # usecols: optional names of the columns to load (e.g. the columns of a known template), the rest are skipped
+    # engine: csv parser, 'c' (default) or 'pyarrow' (falls back to 'c')
+    # na_filter=False: the values are kept as written (empty fields are empty strings, "NA" etc. are not missing values)
     df = None
     above_threshold = False
     tr_ell = False
+    column_filter = None
+    if usecols is not None:
+        wanted = set(str(c) for c in usecols)
+        column_filter = lambda c: str(c) in wanted
     try:
         if filename.endswith('.csv'):
-            df = pd.read_csv(filename, sep=delimiter, header=header, encoding=encoding, dtype=type, nrows=nrows)
+            if engine == 'pyarrow' and nrows is None:
+                df = read_csv_arrow(filename, delimiter, header, encoding, type, column_filter, na_filter)
+            if df is None:
+                csv_usecols = column_filter
+                if column_filter is not None and header is None:
+                    # Without a header pandas gives no rows for a callable usecols, the column positions are given instead
+                    names = pd.read_csv(filename, sep=delimiter, header=None, encoding=encoding, nrows=0).columns
+                    csv_usecols = [c for c in names if column_filter(c)]
+                df = pd.read_csv(filename, sep=delimiter, header=header, encoding=encoding, dtype=type, nrows=nrows, usecols=csv_usecols, na_filter=na_filter)
         elif filename.endswith('.xlsx'):
-            df = pd.read_excel(filename, dtype=str)
+            df = pd.read_excel(filename, dtype=str, usecols=column_filter, na_filter=na_filter)
         elif filename.endswith('.json'):
             df = pd.read_json(filename, dtype=str)
+            if column_filter is not None:
+                df = df[[c for c in df.columns if column_filter(c)]]
         elif filename.endswith('.jlx'):
-            df = jlx2df(filename, jlx_spec)
+            df = jlx2df(filename, jlx_spec, usecols=fixed_width_usecols(usecols), nrows=nrows)
         else:
-            df = fwf2df(filename, fwf_spec)
+            df = fwf2df(filename, fwf_spec, usecols=fixed_width_usecols(usecols), nrows=nrows)
     except Exception as e:
         print(repr(e))
         pass
@@ -149,11 +254,21 @@ def get_df_columns(df):
     return list(df)
 
 def get_df_as_type_string(df):
-    df = df.replace(np.nan, "")
-    columns = get_df_columns(df)
-    for c in columns:
-        if df.dtypes[c] != object:
-            df[c] = df[c].astype("string")
+    # Only the columns with missing values or not of a string dtype are converted: a frame loaded as strings
+    # without NA filtering (get_dataframe na_filter=False) is returned as it is, without a copy
+    converted = {}
+    for i, c in enumerate(get_df_columns(df)):
+        original = column = df.iloc[:, i]
+        if column.hasnans:
+            column = column.replace(np.nan, "")
+        if column.dtype != object and not isinstance(column.dtype, pd.StringDtype):
+            column = column.astype("string")
+        if column is not original:
+            converted[i] = column
+    if converted:
+        df = df.copy(deep=False)
+        for i, column in converted.items():
+            df.isetitem(i, column)
     return df
 
 def csv_data_structure(df, method='describe'):
@@ -316,8 +431,15 @@ def export_to_xml_template(filename, engine, to_string=False):
         ET.SubElement(rule, "column_to_check").text = engine.columns_to_check[i]
         ET.SubElement(rule, "rule_name").text = r.name
         vr = ET.SubElement(rule, "value_range")
-        for v in engine.acceptable_values[i]:
-            ET.SubElement(vr, "value").text = v
+        source = getattr(engine.acceptable_values[i], 'source', None)
+        if source and not to_string:
+            # Code list loaded from file, keep the reference instead of inlining the values
+            vr.set('file', source)
+            for v in engine.acceptable_values[i].inline:
+                ET.SubElement(vr, "value").text = v
+        else:
+            for v in engine.acceptable_values[i]:
+                ET.SubElement(vr, "value").text = v
     cv = ET.SubElement(root, "cross_validation")
     for i, (j, k) in enumerate(engine.cross_validation):
         cvi = ET.SubElement(cv, "check")
@@ -332,14 +454,20 @@ def export_to_xml_template(filename, engine, to_string=False):
         ET.indent(tree, space="\t", level=0)
         tree.write(filename, encoding='utf-8', xml_declaration=True)
 
+def read_code_list(filename, encoding='utf-8'):
+    with open(filename, 'r', encoding=encoding) as f:
+        return [line.rstrip('\r\n') for line in f if line.strip('\r\n')]
+
 def import_from_xml_template(source_xml, from_string=False):
     logical_operator = None
     xml_rules = []
     cross_validation = []
     if from_string:
         tree = ET.ElementTree(ET.fromstring(source_xml))
+        template_dir = ''
     else:
         tree = ET.parse(source_xml)
+        template_dir = os.path.dirname(source_xml)
     root = tree.getroot()
     for rules in root.findall('rules'):
         logical_operator = rules.attrib
@@ -348,9 +476,13 @@ def import_from_xml_template(source_xml, from_string=False):
             column_to_check = rule.find('column_to_check').text
             rule_name = rule.find('rule_name').text
             vr = rule.find('value_range')
-            values = []
+            values = ValueRange()
             for v in vr:
                 values.append(v.text)
+            if vr.get('file'):
+                # <value_range file="codes.txt"/>: large code lists, one value per line (relative to the template)
+                code_list = read_code_list(os.path.join(template_dir, vr.get('file')))
+                values = ValueRange(values + code_list, source=vr.get('file'), inline=values)
             xml_rules.append((column_to_check, rule_name, values))
             if xml_rules[rule_id] != (column_to_check, rule_name, values):
                 xml_rules[rule_id] = (column_to_check, rule_name, values)
@@ -361,6 +493,21 @@ def import_from_xml_template(source_xml, from_string=False):
             cross_validation.append((int(when), int(then)))
     return logical_operator, xml_rules, cross_validation
 
+def get_template_columns(source_xml, from_string=False):
+    # Columns checked by the rules of a template, in order (None when the template checks all the columns)
+    columns = None
+    try:
+        if from_string:
+            root = ET.fromstring(source_xml)
+        else:
+            root = ET.parse(source_xml).getroot()
+        columns = list(dict.fromkeys(c.text for c in root.iter('column_to_check')))
+        if "<<ALL>>" in columns:
+            columns = None
+    except Exception as e:
+        print(repr(e))
+    return columns
+
 def most_frequent_item(List):
     return max(set(List), key=List.count)
 
@@ -375,64 +522,162 @@ def detect_outliers(df, column):
     result = list(zip(df[column].to_list(), outliers_and_anomalies))
     return result
 
-def jlx2df(filename, jl10_spec):
+# Bytes of a fixed width file mapped and sliced at once (aligned to the end of a record)
+FIXED_WIDTH_WINDOW = 64 * 1024 * 1024
+
+def get_jl10_layouts(jl10_spec):
+    # {record type: column widths} of the JL10 specification, the record types with a negative width are skipped
+    jl10_spec_dict = {}
+    jl10_spec_list = jl10_spec.split('|')
+    for r_spec in jl10_spec_list:
+        r_spec_list = r_spec.split(':')
+        if len(r_spec_list) == 2:
+            rid = r_spec_list[0]
+            rdata = r_spec_list[1]
+            jl10_spec_dict[rid] = rdata
+    return {k: [int(c) for c in v.split(',')] for k, v in jl10_spec_dict.items() if '-' not in v}
+
+def fixed_width_block(data, layouts, columns, ignored, encoding, missing=''):
+    # Values of the given columns of the records of data (bytes of whole records), as in text mode:
+    # a record includes its line break ('\n'), the values are sliced by character.
+    # missing: value of the columns which are not in the layout of a record
+    nl = np.flatnonzero(data == 10)
+    starts = np.concatenate(([0], nl + 1))
+    ends = np.append(nl + 1, len(data))
+    if starts[-1] == len(data):
+        starts, ends = starts[:-1], ends[:-1]
+    has_nl = data[ends - 1] == 10
+    content_end = ends - has_nl
+    crlf = has_nl & (content_end > starts)
+    crlf[crlf] = data[content_end[crlf] - 1] == 13
+    content_end = content_end - crlf
+    length = content_end - starts
+    # Records with non ASCII characters are decoded and sliced per character
+    non_ascii = np.zeros(len(starts), dtype=bool)
+    high = np.flatnonzero(data >= 128)
+    if len(high) > 0:
+        non_ascii[np.unique(np.searchsorted(starts, high, 'right') - 1)] = True
+    def startswith(prefix):
+        prefix = np.frombuffer(prefix.encode(encoding), dtype=np.uint8)
+        match = length >= len(prefix)
+        for k, b in enumerate(prefix):
+            match[match] = data[starts[match] + k] == b
+        return match
+    # Layout of every record (-1: the record is skipped)
+    layout_ids = np.full(len(starts), -1)
+    widths = list(layouts.values())
+    if None in layouts:
+        keep = np.ones(len(starts), dtype=bool)
+        for x in ignored:
+            keep &= ~startswith(x)
+        layout_ids[keep] = 0
+    else:
+        for i, record_type in enumerate(layouts):
+            if len(record_type) == 1:
+                layout_ids[startswith(record_type) & (layout_ids < 0)] = i
+    kept = np.flatnonzero(layout_ids >= 0)
+    starts, content_end, has_nl, length, layout_ids, non_ascii = starts[kept], content_end[kept], has_nl[kept], length[kept], layout_ids[kept], non_ascii[kept]
+    values = {c: np.full(len(starts), missing, dtype=object) for c in columns}
+    for layout_id, col_widths in enumerate(widths):
+        in_layout = layout_ids == layout_id
+        ascii_rows = np.flatnonzero(in_layout & ~non_ascii)
+        text_rows = np.flatnonzero(in_layout & non_ascii)
+        texts = [data[starts[r]:content_end[r]].tobytes().decode(encoding) + ('\n' if has_nl[r] else '') for r in text_rows]
+        offsets = np.concatenate(([0], np.cumsum(col_widths)))
+        for c in columns:
+            if c >= len(col_widths):
+                continue
+            s, w = int(offsets[c]), col_widths[c]
+            if w > 0 and len(ascii_rows) > 0:
+                pos = s + np.arange(w)
+                row_len = length[ascii_rows][:, None]
+                idx = np.minimum(starts[ascii_rows][:, None] + pos, len(data) - 1)
+                field = np.where(pos < row_len, data[idx], 0).astype(np.uint8)
+                field[(pos == row_len) & has_nl[ascii_rows][:, None]] = 10
+                values[c][ascii_rows] = np.ascontiguousarray(field).view(f'S{w}').ravel().astype(f'U{w}').astype(object)
+            elif len(ascii_rows) > 0:
+                values[c][ascii_rows] = ''
+            for r, text in zip(text_rows, texts):
+                values[c][r] = text[s:s + w]
+    return values
+
+def read_fixed_width(filename, layouts, usecols=None, ignored=(), encoding='utf-8', nrows=None, window=FIXED_WIDTH_WINDOW, missing=''):
+    # Generator of the dataframe blocks (columns Column_i) of a fixed width file read through a memory map.
+    # layouts: {record type (first character): column widths}, or {None: column widths} for all the records
+    # except the ones starting with an ignored prefix. Only the usecols columns (indexes) are sliced and decoded.
+    # The columns which are not in the layout of a record get the missing value ('' as in get_df_as_type_string).
+    n_columns = max((len(w) for w in layouts.values()), default=0)
+    columns = list(range(n_columns)) if usecols is None else sorted(c for c in usecols if c < n_columns)
+    names = ['Column_' + str(c) for c in columns]
+    rows = 0
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0 or nrows == 0:
+            yield pd.DataFrame({name: pd.Series(dtype=object) for name in names})
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = np.frombuffer(mm, dtype=np.uint8)
+        try:
+            start = 0
+            while start < size and (nrows is None or rows < nrows):
+                end = mm.find(b'\n', min(start + window, size) - 1)
+                end = size if end == -1 else end + 1
+                values = fixed_width_block(buf[start:end], layouts, columns, ignored, encoding, missing)
+                df = pd.DataFrame({name: values[c] for name, c in zip(names, columns)}, dtype=object)
+                if nrows is not None:
+                    df = df.iloc[:nrows - rows]
+                rows += len(df)
+                start = end
+                yield df
+        finally:
+            buf = None
+            try:
+                mm.close()
+            except BufferError:
+                # A view of the map is still referenced (e.g. by a traceback), it is released with it
+                pass
+
+def read_fixed_width_df(filename, layouts, usecols=None, ignored=(), encoding='utf-8', nrows=None):
+    # NaN for the missing values: the columns of the record types which are not in the file are dropped
+    blocks = list(read_fixed_width(filename, layouts, usecols, ignored, encoding, nrows, missing=np.nan))
+    df = pd.concat(blocks, ignore_index=True) if len(blocks) > 1 else blocks[0]
+    if usecols is None and len(df) > 0:
+        # Only the columns of the record types found in the file
+        df = df.loc[:, df.notna().any()]
+    return df
+
+def fixed_width_usecols(usecols):
+    # Column names (Column_i) of a fixed width file -> column indexes
+    if usecols is None:
+        return None
+    return sorted(set(int(c[7:]) for c in map(str, usecols) if c.startswith('Column_') and c[7:].isdigit()))
+
+def jlx2df(filename, jl10_spec, usecols=None, nrows=None):
     df = None
     try:
-        jl10_spec_dict = {}
-        jl10_spec_list = jl10_spec.split('|')
-        for r_spec in jl10_spec_list:
-            r_spec_list = r_spec.split(':')
-            if len(r_spec_list) == 2:
-                rid = r_spec_list[0]
-                rdata = r_spec_list[1]
-                jl10_spec_dict[rid] = rdata
-        with open(filename, 'r', encoding='utf-8') as file:
-            data = []
-            for record in file:
-                if record[0] in jl10_spec_dict and '-' not in jl10_spec_dict[record[0]]:
-                    col_spec_list = jl10_spec_dict[record[0]].split(',')
-                    start = 0
-                    rdict = {}
-                    for i, c in enumerate(col_spec_list):
-                        colname = 'Column_' + str(i)
-                        end = start + int(c)
-                        coldata = record[start:end]
-                        rdict[colname] = coldata
-                        start = end
-                    data.append(rdict)
-            df = pd.DataFrame(data)
+        df = read_fixed_width_df(filename, get_jl10_layouts(jl10_spec), usecols=usecols, nrows=nrows)
     except Exception as e:
         print(repr(e))
     return df
 
-def fwf2df(filename, fwf_spec):
+def fwf2df(filename, fwf_spec, usecols=None, nrows=None):
     df = None
-    col_spec_list = fwf_spec['specification'].split(',')
+    col_spec_list = [int(c) for c in fwf_spec['specification'].split(',')]
     ignored_list = fwf_spec['ignore'].split(',')
     try:
-        with open(filename, 'r', encoding='utf-8') as file:
-            data = []
-            for record in file:
-                ignored_record = False
-                for x in ignored_list:
-                    if record.startswith(x):
-                        ignored_record = True
-                        break
-                if not ignored_record:
-                    start = 0
-                    rdict = {}
-                    for i, c in enumerate(col_spec_list):
-                        colname = 'Column_' + str(i)
-                        end = start + int(c)
-                        coldata = record[start:end]
-                        rdict[colname] = coldata
-                        start = end
-                    data.append(rdict)
-            df = pd.DataFrame(data)
+        df = read_fixed_width_df(filename, {None: col_spec_list}, usecols=usecols, ignored=ignored_list, nrows=nrows)
     except Exception as e:
         print(repr(e))
     return df
 
+def get_stream_reader(filename, jlx_spec=None, fwf_spec=None):
+    # Block reader of the stream mode for the fixed width files: reader(usecols) -> dataframe blocks (None for csv files)
+    if filename.lower().endswith('.csv'):
+        return None
+    if filename.lower().endswith('.jlx'):
+        return lambda usecols: read_fixed_width(filename, get_jl10_layouts(jlx_spec), usecols=usecols)
+    return lambda usecols: read_fixed_width(filename, {None: [int(c) for c in fwf_spec['specification'].split(',')]}, usecols=usecols, ignored=fwf_spec['ignore'].split(','))
+
 def ip4_addresses():
     ip_list = []
     """ Linux only version """